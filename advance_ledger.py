@@ -0,0 +1,79 @@
+"""
+Advance deduction ledger
+Loads every advance that is active for a pay period in one query, works out
+each deduction in memory and writes the new balances and one AdvanceDeduction
+row per deduction in bulk. These writes go into the payroll run's transaction,
+so repaying advances costs the same few statements however many advances
+there are.
+"""
+
+from models import db, Advance, AdvanceDeduction
+
+
+def load_active_advances(pay_period_end):
+    """Return {user_id: [advance dict, ...]} for advances granted by the end of the period"""
+    rows = (
+        db.session.query(
+            Advance.id,
+            Advance.user_id,
+            Advance.monthly_deduction,
+            Advance.remaining_balance,
+            Advance.status
+        )
+        .filter(
+            Advance.status == 'active',
+            Advance.remaining_balance > 0,
+            Advance.advance_date <= pay_period_end
+        )
+        .order_by(Advance.id)
+        .all()
+    )
+    advances = {}
+    for advance_id, user_id, monthly_deduction, remaining_balance, status in rows:
+        advances.setdefault(user_id, []).append({
+            'id': advance_id,
+            'user_id': user_id,
+            'monthly_deduction': monthly_deduction,
+            'remaining_balance': remaining_balance,
+            'status': status
+        })
+    return advances
+
+
+def compute_deductions(advances, pay_period_start, pay_period_end):
+    """Work out this period's deduction for each advance without touching the session.
+
+    Returns (total deducted, advance update mappings, ledger entry mappings).
+    """
+    total = 0.0
+    updates = []
+    entries = []
+    for advance in advances:
+        if advance['remaining_balance'] <= 0:
+            continue
+        deduction = min(advance['monthly_deduction'], advance['remaining_balance'])
+        remaining = round(advance['remaining_balance'] - deduction, 2)
+        updates.append({
+            'id': advance['id'],
+            'remaining_balance': remaining,
+            'status': 'completed' if remaining <= 0 else advance['status']
+        })
+        entries.append({
+            'advance_id': advance['id'],
+            'user_id': advance['user_id'],
+            'pay_period_start': pay_period_start,
+            'pay_period_end': pay_period_end,
+            'amount': deduction,
+            'balance_after': remaining
+        })
+        total += deduction
+    return total, updates, entries
+
+
+def write_deductions(updates, entries):
+    """Add the balance updates and ledger rows to the session; the caller commits"""
+    if updates:
+        db.session.bulk_update_mappings(Advance, updates)
+    if entries:
+        db.session.bulk_insert_mappings(AdvanceDeduction, entries)
+
@@ -1,34 +1,110 @@
-from flask import Flask, render_template, request, redirect, url_for, session, flash, jsonify
+from flask import Flask, render_template, request, redirect, url_for, session, flash, jsonify, g, Response, send_file, stream_with_context
 from flask_sqlalchemy import SQLAlchemy
 from flask_wtf import FlaskForm
+from flask_wtf.file import FileField, FileRequired, FileAllowed
 from wtforms import StringField, PasswordField, BooleanField, FloatField, IntegerField, SubmitField, TextAreaField, DateField, SelectField
 from wtforms.validators import DataRequired, Email, Length, Optional
 from werkzeug.security import generate_password_hash, check_password_hash
 from datetime import datetime, date, time, timedelta
 import calendar
+import click
 import json
 import urllib.parse
 import os
 from functools import wraps
 
 # Import models
-from models import db, User, EmployeeDetails, Attendance, Department, Leave, MonthlyPayout, AuditLog, Advance
+from models import db, User, EmployeeDetails, Attendance, Department, Leave, MonthlyPayout, AuditLog, Advance, PayrollJob, Holiday, WeeklyOffRule
 from database_config import get_database_uri
+from payroll_config import config as config_by_name
+import payroll_engine
+import payroll_export
+import payslips
+import attendance_rollup
+import attendance_batch
+import attendance_import
+import attendance_bitsets
+import archive
+import leave_index
+from role_cache import role_cache
+from work_calendar import work_calendar
+from query_profiles import with_profile, init_statement_budget
+import pagination
+import replica
+from replica import REPLICA_BIND, read_only
+import sql_instrumentation
+import audit
+import metrics
 
 app = Flask(__name__)
 app.config['SECRET_KEY'] = os.environ.get('SECRET_KEY', 'your-secret-key-here-change-in-production')
 app.config['SQLALCHEMY_DATABASE_URI'] = get_database_uri()
 app.config['SQLALCHEMY_TRACK_MODIFICATIONS'] = False
+if get_database_uri(replica=True):
+    # Serves @read_only views; see replica.py
+    app.config['SQLALCHEMY_BINDS'] = {REPLICA_BIND: get_database_uri(replica=True)}
+app.config['REPLICA_MAX_LAG_SECONDS'] = float(os.environ.get('REPLICA_MAX_LAG_SECONDS', 10))
+app.config['REPLICA_CHECK_INTERVAL'] = float(os.environ.get('REPLICA_CHECK_INTERVAL', 5))
+# Pool sizing comes from payroll_config (ProductionConfig when FLASK_ENV=production)
+app.config['SQLALCHEMY_ENGINE_OPTIONS'] = dict(
+    config_by_name.get(os.environ.get('FLASK_ENV'), config_by_name['default']).SQLALCHEMY_ENGINE_OPTIONS,
+    **metrics.engine_options(app.config['SQLALCHEMY_DATABASE_URI'])
+)
+# Seconds a user's role may be served from the cross-request cache; 0 disables it
+app.config['ROLE_CACHE_TTL'] = int(os.environ.get('ROLE_CACHE_TTL', 0))
+# Seconds each process may reuse holiday and weekly-off rules before reloading them
+app.config['WORK_CALENDAR_TTL'] = int(os.environ.get('WORK_CALENDAR_TTL', 300))
+# Rows upserted and committed together by the attendance CSV import
+app.config['ATTENDANCE_IMPORT_CHUNK_SIZE'] = int(os.environ.get('ATTENDANCE_IMPORT_CHUNK_SIZE', 1000))
+# Rendered payslip PDFs, reused until the payout changes
+app.config['PAYSLIP_CACHE_DIR'] = os.environ.get('PAYSLIP_CACHE_DIR', os.path.join(app.instance_path, 'payslips'))
+# Maximum SQL statements per request; set in tests to catch N+1 regressions
+app.config['SQL_STATEMENT_LIMIT'] = None
+
+# Longest range the payroll report will pivot into month columns
+MAX_REPORT_MONTHS = 24
 
 db.init_app(app)
+role_cache.ttl = app.config['ROLE_CACHE_TTL']
+work_calendar.ttl = app.config['WORK_CALENDAR_TTL']
+audit.init_app(app)
+sql_instrumentation.init_app(app)
+init_statement_budget(app)
+metrics.init_app(app)
+
+def dispose_pool_after_fork():
+    """Drop pooled connections inherited from the parent so the worker opens its own"""
+    with app.app_context():
+        for bind in [None] + list(app.config.get('SQLALCHEMY_BINDS') or {}):
+            # close=False leaves the parent's sockets alone; closing them here would break the parent
+            db.get_engine(app, bind=bind).dispose(close=False)
+
+def get_current_user():
+    """Return the logged-in User, loading it at most once per request"""
+    if 'current_user' not in g:
+        g.current_user = User.query.get(session['user_id']) if 'user_id' in session else None
+    return g.current_user
+
+def get_current_role():
+    """Return the logged-in user's role, using the role cache when enabled"""
+    if 'user_id' not in session:
+        return None
+    role = role_cache.get(session['user_id'])
+    if role is None:
+        user = get_current_user()
+        if user is None:
+            return None
+        role = user.role
+        role_cache.set(user.id, role)
+    return role
 
 def admin_required(f):
     @wraps(f)
     def decorated_function(*args, **kwargs):
-        if 'user_id' not in session:
+        role = get_current_role()
+        if role is None:
             return redirect(url_for('login'))
-        user = User.query.get(session['user_id'])
-        if user.role != 'admin':
+        if role != 'admin':
             flash('Access denied. Admin privileges required.', 'error')
             return redirect(url_for('employee_dashboard'))
         return f(*args, **kwargs)
@@ -37,10 +113,10 @@ def admin_required(f):
 def manager_required(f):
     @wraps(f)
     def decorated_function(*args, **kwargs):
-        if 'user_id' not in session:
+        role = get_current_role()
+        if role is None:
             return redirect(url_for('login'))
-        user = User.query.get(session['user_id'])
-        if user.role not in ['admin', 'manager']:
+        if role not in ['admin', 'manager']:
             flash('Access denied. Manager privileges required.', 'error')
             return redirect(url_for('employee_dashboard'))
         return f(*args, **kwargs)
@@ -48,9 +124,45 @@ def manager_required(f):
 
 @app.context_processor
 def inject_current_user():
-    if 'user_id' in session:
-        return {'current_user': User.query.get(session['user_id'])}
-    return {'current_user': None}
+    return {'current_user': get_current_user()}
+
+def list_filters(date_column=None):
+    """Read the status/date filters shared by admin list pages.
+
+    Returns the filter criteria and the query args to carry into page links.
+    """
+    criteria = []
+    args = {}
+    per_page = request.args.get('per_page')
+    if per_page:
+        args['per_page'] = pagination.page_size(per_page)
+    if date_column is not None:
+        for arg, compare in (('date_from', date_column.__ge__), ('date_to', date_column.__le__)):
+            value = request.args.get(arg)
+            if not value:
+                continue
+            try:
+                criteria.append(compare(date.fromisoformat(value)))
+                args[arg] = value
+            except ValueError:
+                flash(f'Ignoring invalid date: {value}', 'warning')
+    return criteria, args
+
+def paginate_list(query, sort_column, id_column, descending=True):
+    """Keyset-paginate a list query using the after/before/per_page query args"""
+    per_page = pagination.page_size(request.args.get('per_page', pagination.DEFAULT_PAGE_SIZE))
+    try:
+        return pagination.keyset_paginate(
+            query, sort_column, id_column,
+            after=request.args.get('after'),
+            before=request.args.get('before'),
+            per_page=per_page,
+            descending=descending
+        )
+    except pagination.InvalidCursor:
+        flash('That page link has expired; showing the first page.', 'warning')
+        return pagination.keyset_paginate(query, sort_column, id_column, per_page=per_page, descending=descending)
+
 class LoginForm(FlaskForm):
     username = StringField('Username', validators=[DataRequired()])
     password = PasswordField('Password', validators=[DataRequired()])
@@ -88,6 +200,10 @@ class AttendanceForm(FlaskForm):
     notes = TextAreaField('Notes')
     submit = SubmitField('Submit Attendance')
 
+class AttendanceImportForm(FlaskForm):
+    file = FileField('Attendance CSV', validators=[FileRequired(), FileAllowed(['csv'], 'CSV files only')])
+    submit = SubmitField('Import')
+
 class LeaveForm(FlaskForm):
     leave_type = SelectField('Leave Type', choices=[
         ('sick', 'Sick Leave'),
@@ -104,6 +220,7 @@ class LeaveForm(FlaskForm):
 class PayrollForm(FlaskForm):
     pay_period_start = DateField('Pay Period Start', validators=[DataRequired()])
     pay_period_end = DateField('Pay Period End', validators=[DataRequired()])
+    parallel = BooleanField('Compute departments in parallel')
     submit = SubmitField('Generate Payroll')
 
 class AdvanceForm(FlaskForm):
@@ -117,12 +234,22 @@ class AdvanceForm(FlaskForm):
 @app.route('/health')
 def health_check():
     """Health check endpoint for Docker and monitoring"""
-    return {'status': 'healthy', 'database': 'not_tested'}, 200
+    try:
+        db.session.execute(db.text('SELECT 1'))
+    except Exception as e:
+        db.session.rollback()
+        app.logger.error(f"Health check database error: {e}")
+        return {'status': 'unhealthy', 'database': 'unavailable'}, 503
+    status = {'status': 'healthy', 'database': 'ok'}
+    if replica.replica_configured(app):
+        # A bad replica only means reads fall back to the primary
+        status['replica'] = 'ok' if replica.replica_engine(app) is not None else 'unavailable'
+    return status, 200
 
 @app.route('/')
 def index():
     if 'user_id' in session:
-        user = User.query.get(session['user_id'])
+        user = get_current_user()
         if user.role == 'admin':
             return redirect(url_for('admin_dashboard'))
         else:
@@ -151,7 +278,7 @@ def logout():
 def admin_dashboard():
     if 'user_id' not in session:
         return redirect(url_for('login'))
-    user = User.query.get(session['user_id'])
+    user = get_current_user()
     if user.role != 'admin':
         return redirect(url_for('employee_dashboard'))
 
@@ -216,49 +343,68 @@ def edit_employee(employee_id):
     return render_template('edit_employee.html', employee=employee)
 
 @app.route('/admin/payroll_report')
+@read_only
 def payroll_report():
     if 'user_id' not in session:
         return redirect(url_for('login'))
-    user = User.query.get(session['user_id'])
+    user = get_current_user()
     if user.role != 'admin':
         return redirect(url_for('employee_dashboard'))
 
-    current_month = datetime.now().month
-    current_year = datetime.now().year
-    _, last_day = calendar.monthrange(current_year, current_month)
-
-    employees = User.query.filter_by(role='employee').all()
+    today = date.today()
+    year = request.args.get('year', today.year, type=int)
+    month = request.args.get('month', today.month, type=int)
+    end_year = request.args.get('end_year', year, type=int)
+    end_month = request.args.get('end_month', month, type=int)
+
+    if (not (1 <= year <= 9999 and 1 <= end_year <= 9999 and 1 <= month <= 12 and 1 <= end_month <= 12)
+            or (end_year, end_month) < (year, month)):
+        flash('Invalid report period.', 'error')
+        year, month, end_year, end_month = today.year, today.month, today.year, today.month
+
+    months = attendance_rollup.month_range(year, month, end_year, end_month)
+    if len(months) > MAX_REPORT_MONTHS:
+        flash(f'Reports are limited to {MAX_REPORT_MONTHS} months.', 'warning')
+        months = months[:MAX_REPORT_MONTHS]
+        end_year, end_month = months[-1]
+
+    working_days = {
+        (report_year, report_month): work_calendar.working_days(*attendance_rollup.month_bounds(report_year, report_month))
+        for report_year, report_month in months
+    }
+    try:
+        monthly_report = attendance_rollup.load_monthly_report(months)
+    except attendance_rollup.RollupNotBuilt as e:
+        flash(str(e), 'error')
+        monthly_report = []
     report = []
-
-    for emp in employees:
-        if not emp.daily_rate:
-            continue
-
-        # Get attendance for current month
-        attendance_records = Attendance.query.filter(
-            Attendance.user_id == emp.id,
-            Attendance.date >= date(current_year, current_month, 1),
-            Attendance.date <= date(current_year, current_month, last_day)
-        ).all()
-
-        days_present = sum(1 for a in attendance_records if a.present)
-
-        salary = days_present * emp.daily_rate
-
+    for user_id, name, is_hourly, daily_rate, per_month in monthly_report:
+        month_rows = []
+        for (report_year, report_month), (days_present, total_hours) in zip(months, per_month):
+            month_rows.append({
+                'days_present': days_present,
+                'total_days': working_days[(report_year, report_month)],
+                'total_hours': total_hours,
+                'salary': round(days_present * daily_rate, 2)
+            })
         report.append({
-            'employee': emp,
-            'days_present': days_present,
-            'total_days': last_day,
-            'salary': round(salary, 2)
+            'user_id': user_id,
+            'name': name,
+            'is_hourly': is_hourly,
+            'months': month_rows,
+            'days_present': sum(m['days_present'] for m in month_rows),
+            'total_hours': sum(m['total_hours'] for m in month_rows),
+            'salary': round(sum(m['salary'] for m in month_rows), 2)
         })
 
-    return render_template('payroll_report.html', report=report, month=current_month, year=current_year)
+    return render_template('payroll_report.html', report=report, months=months,
+                           month=month, year=year, end_month=end_month, end_year=end_year)
 
 @app.route('/employee')
 def employee_dashboard():
     if 'user_id' not in session:
         return redirect(url_for('login'))
-    user = User.query.get(session['user_id'])
+    user = get_current_user()
     if user.role == 'admin':
         return redirect(url_for('admin_dashboard'))
 
@@ -271,7 +417,7 @@ def employee_dashboard():
 def mark_attendance():
     if 'user_id' not in session:
         return redirect(url_for('login'))
-    user = User.query.get(session['user_id'])
+    user = get_current_user()
     if user.role == 'admin':
         return redirect(url_for('admin_dashboard'))
 
@@ -300,21 +446,23 @@ def mark_attendance():
 
 # CRUD Routes for Departments
 @app.route('/admin/departments')
+@read_only
 def manage_departments():
     if 'user_id' not in session:
         return redirect(url_for('login'))
-    user = User.query.get(session['user_id'])
+    user = get_current_user()
     if not user.is_admin():
         return redirect(url_for('employee_dashboard'))
 
-    departments = Department.query.all()
-    return render_template('departments.html', departments=departments)
+    _, filters = list_filters()
+    page = paginate_list(Department.query, Department.id, Department.id, descending=False)
+    return render_template('departments.html', departments=page, page=page, filters=filters)
 
 @app.route('/admin/departments/add', methods=['GET', 'POST'])
 def add_department():
     if 'user_id' not in session:
         return redirect(url_for('login'))
-    user = User.query.get(session['user_id'])
+    user = get_current_user()
     if not user.is_admin():
         return redirect(url_for('employee_dashboard'))
 
@@ -333,7 +481,7 @@ def add_department():
 def edit_department(dept_id):
     if 'user_id' not in session:
         return redirect(url_for('login'))
-    user = User.query.get(session['user_id'])
+    user = get_current_user()
     if not user.is_admin():
         return redirect(url_for('employee_dashboard'))
 
@@ -353,7 +501,7 @@ def edit_department(dept_id):
 def delete_department(dept_id):
     if 'user_id' not in session:
         return redirect(url_for('login'))
-    user = User.query.get(session['user_id'])
+    user = get_current_user()
     if not user.is_admin():
         return jsonify({'error': 'Unauthorized'}), 403
 
@@ -364,21 +512,28 @@ def delete_department(dept_id):
 
 # Enhanced Employee CRUD
 @app.route('/admin/employees')
+@read_only
 def manage_employees():
     if 'user_id' not in session:
         return redirect(url_for('login'))
-    user = User.query.get(session['user_id'])
+    user = get_current_user()
     if not user.is_manager():
         return redirect(url_for('employee_dashboard'))
 
-    employees = User.query.filter_by(role='employee').all()
-    return render_template('employees.html', employees=employees)
+    criteria, filters = list_filters()
+    query = with_profile(User.query.filter_by(role='employee'), 'employee_list').filter(*criteria)
+    status = request.args.get('status')
+    if status in ('active', 'inactive'):
+        query = query.filter(User.is_active == (status == 'active'))
+        filters['status'] = status
+    page = paginate_list(query, User.id, User.id, descending=False)
+    return render_template('employees.html', employees=page, page=page, filters=filters)
 
 @app.route('/admin/employees/add', methods=['GET', 'POST'])
 def add_employee_new():
     if 'user_id' not in session:
         return redirect(url_for('login'))
-    user = User.query.get(session['user_id'])
+    user = get_current_user()
     if not user.is_admin():
         return redirect(url_for('employee_dashboard'))
 
@@ -429,7 +584,7 @@ def add_employee_new():
 def edit_employee_new(emp_id):
     if 'user_id' not in session:
         return redirect(url_for('login'))
-    user = User.query.get(session['user_id'])
+    user = get_current_user()
     if not user.is_admin():
         return redirect(url_for('employee_dashboard'))
 
@@ -466,7 +621,7 @@ def edit_employee_new(emp_id):
 def delete_employee(emp_id):
     if 'user_id' not in session:
         return redirect(url_for('login'))
-    user = User.query.get(session['user_id'])
+    user = get_current_user()
     if not user.is_admin():
         return jsonify({'error': 'Unauthorized'}), 403
 
@@ -480,7 +635,7 @@ def delete_employee(emp_id):
 def manage_attendance():
     if 'user_id' not in session:
         return redirect(url_for('login'))
-    user = User.query.get(session['user_id'])
+    user = get_current_user()
     if not user.is_manager():
         return redirect(url_for('employee_dashboard'))
 
@@ -497,12 +652,14 @@ def manage_attendance():
 def update_attendance(emp_id):
     if 'user_id' not in session:
         return redirect(url_for('login'))
-    user = User.query.get(session['user_id'])
+    user = get_current_user()
     if not user.is_manager():
         return jsonify({'error': 'Unauthorized'}), 403
 
     data = request.get_json()
     attendance_date = date.fromisoformat(data['date'])
+    if archive.archived_attendance({(emp_id, attendance_date)}):
+        return jsonify({'error': f'Attendance on {attendance_date} is archived and can no longer be changed'}), 400
 
     attendance = Attendance.query.filter_by(user_id=emp_id, date=attendance_date).first()
     if attendance:
@@ -522,27 +679,97 @@ def update_attendance(emp_id):
 
     return jsonify({'success': True})
 
+@app.route('/admin/attendance/import', methods=['GET', 'POST'])
+def import_attendance():
+    if 'user_id' not in session:
+        return redirect(url_for('login'))
+    user = get_current_user()
+    if not user.is_admin():
+        flash('Access denied. Admin privileges required.', 'error')
+        return redirect(url_for('employee_dashboard'))
+
+    form = AttendanceImportForm()
+    report = None
+    if form.validate_on_submit():
+        try:
+            report = attendance_import.import_attendance(
+                form.file.data.stream,
+                chunk_size=app.config['ATTENDANCE_IMPORT_CHUNK_SIZE']
+            )
+        except (attendance_import.InvalidImportFile, UnicodeDecodeError) as e:
+            flash(f'Could not read file: {e}', 'error')
+        else:
+            category = 'warning' if report.error_count else 'success'
+            flash(f'Imported {report.rows_imported} of {report.rows_read} rows.', category)
+
+    return render_template('import_attendance.html', form=form, report=report)
+
+@app.route('/admin/attendance/batch', methods=['POST'])
+def batch_update_attendance():
+    """Save a whole day's roster: {date, entries: [{user_id, present, hours_worked, notes}]}"""
+    if 'user_id' not in session:
+        return redirect(url_for('login'))
+    user = get_current_user()
+    if not user.is_manager():
+        return jsonify({'error': 'Unauthorized'}), 403
+
+    data = request.get_json(silent=True) or {}
+    try:
+        attendance_date = date.fromisoformat(data['date'])
+        rows = attendance_batch.parse_entries(data.get('entries'), attendance_date)
+    except (KeyError, TypeError, ValueError) as e:
+        return jsonify({'error': str(e) or 'A valid date is required'}), 400
+
+    try:
+        saved = attendance_batch.upsert_attendance(rows)
+        db.session.commit()
+    except archive.ArchivedDateError as e:
+        db.session.rollback()
+        return jsonify({'error': str(e)}), 400
+    except Exception as e:
+        db.session.rollback()
+        app.logger.error(f"Batch attendance error: {e}")
+        return jsonify({'error': 'Error saving attendance'}), 500
+
+    return jsonify({'success': True, 'saved': saved})
+
 # Leave Management
 @app.route('/admin/leaves')
+@read_only
 def manage_leaves():
     if 'user_id' not in session:
         return redirect(url_for('login'))
-    user = User.query.get(session['user_id'])
+    user = get_current_user()
     if not user.is_manager():
         return redirect(url_for('employee_dashboard'))
 
-    leaves = Leave.query.order_by(Leave.created_at.desc()).all()
-    return render_template('leaves.html', leaves=leaves)
+    criteria, filters = list_filters(Leave.start_date)
+    query = with_profile(Leave.query, 'leave_list').filter(*criteria)
+    status = request.args.get('status')
+    if status:
+        query = query.filter(Leave.status == status)
+        filters['status'] = status
+    page = paginate_list(query, Leave.created_at, Leave.id)
+    return render_template('leaves.html', leaves=page, page=page, filters=filters)
 
 @app.route('/admin/leaves/approve/<int:leave_id>', methods=['POST'])
 def approve_leave(leave_id):
     if 'user_id' not in session:
         return redirect(url_for('login'))
-    user = User.query.get(session['user_id'])
+    user = get_current_user()
     if not user.is_manager():
         return jsonify({'error': 'Unauthorized'}), 403
 
     leave = Leave.query.get_or_404(leave_id)
+    overlaps = [
+        interval for interval in leave_index.find_overlaps(leave.user_id, leave.start_date, leave.end_date, leave.id)
+        if interval.status == 'approved'
+    ]
+    if overlaps:
+        return jsonify({
+            'error': f'Overlaps approved leave from {overlaps[0].start_date} to {overlaps[0].end_date}'
+        }), 409
+
     leave.update(
         status='approved',
         approved_by=user.id,
@@ -555,7 +782,7 @@ def approve_leave(leave_id):
 def reject_leave(leave_id):
     if 'user_id' not in session:
         return redirect(url_for('login'))
-    user = User.query.get(session['user_id'])
+    user = get_current_user()
     if not user.is_manager():
         return jsonify({'error': 'Unauthorized'}), 403
 
@@ -569,7 +796,7 @@ def reject_leave(leave_id):
 def generate_payroll():
     if 'user_id' not in session:
         return redirect(url_for('login'))
-    user = User.query.get(session['user_id'])
+    user = get_current_user()
     if not user.is_admin():
         return redirect(url_for('employee_dashboard'))
 
@@ -578,83 +805,103 @@ def generate_payroll():
         pay_period_start = form.pay_period_start.data
         pay_period_end = form.pay_period_end.data
 
-        # Check if payroll already exists for this period
-        existing_payroll = MonthlyPayout.query.filter_by(
-            pay_period_start=pay_period_start,
-            pay_period_end=pay_period_end
-        ).first()
-        if existing_payroll:
+        if payroll_engine.payroll_exists(pay_period_start, pay_period_end):
             flash('Payroll already generated for this period.', 'warning')
             return redirect(url_for('payroll_report_new'))
 
-        employees = User.query.filter_by(role='employee').all()
+        if work_calendar.working_days(pay_period_start, pay_period_end) == 0:
+            flash('The pay period has no working days in the work calendar.', 'error')
+            return render_template('generate_payroll.html', form=form, job=None)
 
-        for emp in employees:
-            details = emp.employee_details
-            if not details:
-                continue
-
-            # Get attendance for the pay period
-            attendances = Attendance.query.filter(
-                Attendance.user_id == emp.id,
-                Attendance.date >= pay_period_start,
-                Attendance.date <= pay_period_end
-            ).all()
-
-            days_present = sum(1 for a in attendances if a.present)
-            total_hours = sum(a.hours_worked for a in attendances)
-
-            # Calculate total working days in the period
-            from datetime import timedelta
-            total_days = (pay_period_end - pay_period_start).days + 1
-
-            salary_calc = details.calculate_monthly_salary(days_present, total_days, total_hours)
-
-            # Apply advance deductions
-            advance_deductions = 0.0
-            for advance in emp.advances:
-                if advance.status == 'active':
-                    deduction = advance.calculate_monthly_deduction()
-                    if deduction > 0:
-                        advance.apply_deduction(deduction)
-                        advance_deductions += deduction
-
-            # Recalculate net salary after applying advance deductions
-            net_salary = salary_calc['gross_salary'] - advance_deductions
-
-            MonthlyPayout.create(
-                user_id=emp.id,
+        job = PayrollJob.query.filter(
+            PayrollJob.pay_period_start == pay_period_start,
+            PayrollJob.pay_period_end == pay_period_end,
+            PayrollJob.status.in_(['queued', 'running'])
+        ).first()
+        if job:
+            flash('Payroll for this period is already being generated.', 'info')
+        else:
+            job = PayrollJob.create(
                 pay_period_start=pay_period_start,
                 pay_period_end=pay_period_end,
-                days_present=days_present,
-                total_days=total_days,
-                hours_worked=total_hours,
-                gross_salary=salary_calc['gross_salary'],
-                deductions=advance_deductions,
-                net_salary=net_salary
+                parallel=form.parallel.data,
+                requested_by=user.id
             )
+            flash('Payroll generation queued.', 'success')
+        return redirect(url_for('generate_payroll', job_id=job.id))
 
-        flash('Payroll generated successfully.', 'success')
-        return redirect(url_for('payroll_report'))
+    job_id = request.args.get('job_id', type=int)
+    job = PayrollJob.query.get(job_id) if job_id else None
+    return render_template('generate_payroll.html', form=form, job=job)
 
-    return render_template('generate_payroll.html', form=form)
+@app.route('/admin/payroll/jobs/<int:job_id>')
+def payroll_job_status(job_id):
+    if 'user_id' not in session:
+        return jsonify({'error': 'Unauthorized'}), 401
+    user = get_current_user()
+    if not user.is_admin():
+        return jsonify({'error': 'Unauthorized'}), 403
+
+    job = PayrollJob.query.get_or_404(job_id)
+    return jsonify(job.to_dict())
 
 @app.route('/admin/payroll')
+@read_only
 def payroll_report_new():
     if 'user_id' not in session:
         return redirect(url_for('login'))
-    user = User.query.get(session['user_id'])
+    user = get_current_user()
     if not user.is_admin():
         return redirect(url_for('employee_dashboard'))
 
-    payroll_records = MonthlyPayout.query.order_by(MonthlyPayout.created_at.desc()).all()
-    return render_template('payroll.html', payrolls=payroll_records)
+    criteria, filters = list_filters(MonthlyPayout.pay_period_start)
+    query = with_profile(MonthlyPayout.query, 'payroll_list').filter(*criteria)
+    status = request.args.get('status')
+    if status:
+        query = query.filter(MonthlyPayout.status == status)
+        filters['status'] = status
+    page = paginate_list(query, MonthlyPayout.created_at, MonthlyPayout.id)
+    return render_template('payroll.html', payrolls=page, page=page, filters=filters)
+
+@app.route('/admin/payroll/export')
+@read_only
+def export_payroll():
+    if 'user_id' not in session:
+        return redirect(url_for('login'))
+    user = get_current_user()
+    if not user.is_admin():
+        return redirect(url_for('employee_dashboard'))
+
+    try:
+        pay_period_start = date.fromisoformat(request.args['pay_period_start'])
+        pay_period_end = date.fromisoformat(request.args['pay_period_end'])
+    except (KeyError, ValueError):
+        flash('Select a valid pay period to export.', 'error')
+        return redirect(url_for('payroll_report_new'))
+    if pay_period_end < pay_period_start:
+        flash('Pay period end must not be before its start.', 'error')
+        return redirect(url_for('payroll_report_new'))
+
+    filename = f'payroll_{pay_period_start.isoformat()}_{pay_period_end.isoformat()}'
+    if request.args.get('format') == 'xlsx':
+        return send_file(
+            payroll_export.write_xlsx(pay_period_start, pay_period_end),
+            mimetype='application/vnd.openxmlformats-officedocument.spreadsheetml.sheet',
+            as_attachment=True,
+            download_name=f'{filename}.xlsx'
+        )
+
+    return Response(
+        stream_with_context(payroll_export.iter_csv(pay_period_start, pay_period_end)),
+        mimetype='text/csv',
+        headers={'Content-Disposition': f'attachment; filename={filename}.csv'}
+    )
 
 @app.route('/admin/payroll/view/<int:payroll_id>')
 def view_payroll(payroll_id):
     if 'user_id' not in session:
         return redirect(url_for('login'))
-    user = User.query.get(session['user_id'])
+    user = get_current_user()
     if not user.is_admin():
         return redirect(url_for('employee_dashboard'))
 
@@ -665,7 +912,7 @@ def view_payroll(payroll_id):
 def mark_payroll_paid(payroll_id):
     if 'user_id' not in session:
         return redirect(url_for('login'))
-    user = User.query.get(session['user_id'])
+    user = get_current_user()
     if not user.is_admin():
         return jsonify({'success': False, 'error': 'Unauthorized'}), 403
 
@@ -678,15 +925,22 @@ def mark_payroll_paid(payroll_id):
 
 # Advance Management Routes
 @app.route('/admin/advances')
+@read_only
 def manage_advances():
     if 'user_id' not in session:
         return redirect(url_for('login'))
-    user = User.query.get(session['user_id'])
+    user = get_current_user()
     if not user.is_admin():
         return redirect(url_for('employee_dashboard'))
 
-    advances = Advance.query.order_by(Advance.advance_date.desc()).all()
-    return render_template('manage_advances.html', advances=advances)
+    criteria, filters = list_filters(Advance.advance_date)
+    query = with_profile(Advance.query, 'advance_list').filter(*criteria)
+    status = request.args.get('status')
+    if status:
+        query = query.filter(Advance.status == status)
+        filters['status'] = status
+    page = paginate_list(query, Advance.advance_date, Advance.id)
+    return render_template('manage_advances.html', advances=page, page=page, filters=filters)
 
 @app.route('/admin/advance/create/<int:employee_id>', methods=['GET', 'POST'])
 @admin_required
@@ -720,7 +974,7 @@ def create_advance(employee_id):
 def view_advance(advance_id):
     if 'user_id' not in session:
         return redirect(url_for('login'))
-    user = User.query.get(session['user_id'])
+    user = get_current_user()
     if not user.is_admin():
         return redirect(url_for('employee_dashboard'))
 
@@ -731,7 +985,7 @@ def view_advance(advance_id):
 def delete_advance(advance_id):
     if 'user_id' not in session:
         return redirect(url_for('login'))
-    user = User.query.get(session['user_id'])
+    user = get_current_user()
     if not user.is_admin():
         return redirect(url_for('employee_dashboard'))
 
@@ -747,16 +1001,27 @@ def delete_advance(advance_id):
 def request_leave():
     if 'user_id' not in session:
         return redirect(url_for('login'))
-    user = User.query.get(session['user_id'])
+    user = get_current_user()
     if user.is_admin():
         return redirect(url_for('admin_dashboard'))
 
     form = LeaveForm()
     if form.validate_on_submit():
-        # Calculate days requested
         start_date = form.start_date.data
         end_date = form.end_date.data
-        days_requested = (end_date - start_date).days + 1
+        if end_date < start_date:
+            flash('End date must not be before the start date.', 'error')
+            return render_template('request_leave.html', form=form)
+
+        overlaps = leave_index.find_overlaps(user.id, start_date, end_date)
+        if overlaps:
+            flash(f'These dates overlap your {overlaps[0].status} leave from {overlaps[0].start_date} '
+                  f'to {overlaps[0].end_date}.', 'error')
+            return render_template('request_leave.html', form=form)
+
+        # Weekly days off and holidays are not counted
+        department = user.departments.order_by(Department.id).first()
+        days_requested = work_calendar.working_days(start_date, end_date, department.id if department else None)
 
         leave = Leave.create(
             user_id=user.id,
@@ -776,7 +1041,7 @@ def request_leave():
 def my_leaves():
     if 'user_id' not in session:
         return redirect(url_for('login'))
-    user = User.query.get(session['user_id'])
+    user = get_current_user()
     if user.is_admin():
         return redirect(url_for('admin_dashboard'))
 
@@ -785,11 +1050,12 @@ def my_leaves():
 
 # API Endpoints
 @app.route('/api/attendance/<int:emp_id>', methods=['GET'])
+@read_only
 def get_employee_attendance(emp_id):
     if 'user_id' not in session:
         return jsonify({'error': 'Unauthorized'}), 401
 
-    user = User.query.get(session['user_id'])
+    user = get_current_user()
     if not user.is_manager() and user.id != emp_id:
         return jsonify({'error': 'Unauthorized'}), 403
 
@@ -797,11 +1063,7 @@ def get_employee_attendance(emp_id):
     year = int(request.args.get('year', datetime.now().year))
 
     _, last_day = calendar.monthrange(year, month)
-    attendances = Attendance.query.filter(
-        Attendance.user_id == emp_id,
-        Attendance.date >= date(year, month, 1),
-        Attendance.date <= date(year, month, last_day)
-    ).all()
+    attendances = archive.attendance_rows(emp_id, date(year, month, 1), date(year, month, last_day))
 
     attendance_data = {}
     for attendance in attendances:
@@ -813,12 +1075,78 @@ def get_employee_attendance(emp_id):
 
     return jsonify(attendance_data)
 
+def _date_range_args():
+    """start and end query arguments, defaulting to year to date"""
+    today = date.today()
+    start = date.fromisoformat(request.args.get('start', date(today.year, 1, 1).isoformat()))
+    end = date.fromisoformat(request.args.get('end', today.isoformat()))
+    if end < start:
+        raise ValueError('end must not be before start')
+    return start, end
+
+@app.route('/api/attendance/<int:emp_id>/summary', methods=['GET'])
+@read_only
+def get_attendance_summary(emp_id):
+    if 'user_id' not in session:
+        return jsonify({'error': 'Unauthorized'}), 401
+
+    user = get_current_user()
+    if not user.is_manager() and user.id != emp_id:
+        return jsonify({'error': 'Unauthorized'}), 403
+
+    try:
+        start, end = _date_range_args()
+    except ValueError as e:
+        return jsonify({'error': str(e)}), 400
+
+    department = User.query.get_or_404(emp_id).departments.order_by(Department.id).first()
+    department_id = department.id if department else None
+    try:
+        present_days = attendance_bitsets.present_days(emp_id, start, end)
+        present_working_days = attendance_bitsets.present_working_days(emp_id, start, end, department_id)
+    except attendance_rollup.RollupNotBuilt as e:
+        return jsonify({'error': str(e)}), 503
+    return jsonify({
+        'start': start.isoformat(),
+        'end': end.isoformat(),
+        'present_days': present_days,
+        'working_days': work_calendar.working_days(start, end, department_id),
+        'present_working_days': present_working_days
+    })
+
+@app.route('/api/departments/<int:department_id>/presence', methods=['GET'])
+@read_only
+def get_department_presence(department_id):
+    if 'user_id' not in session:
+        return jsonify({'error': 'Unauthorized'}), 401
+
+    user = get_current_user()
+    if not user.is_manager():
+        return jsonify({'error': 'Unauthorized'}), 403
+
+    try:
+        start, end = _date_range_args()
+    except ValueError as e:
+        return jsonify({'error': str(e)}), 400
+
+    try:
+        daily = attendance_bitsets.department_daily_presence(department_id, start, end)
+    except attendance_rollup.RollupNotBuilt as e:
+        return jsonify({'error': str(e)}), 503
+    return jsonify({
+        'start': start.isoformat(),
+        'end': end.isoformat(),
+        'present_days': sum(count for _, count in daily),
+        'daily': {day.isoformat(): count for day, count in daily}
+    })
+
 @app.route('/api/dashboard/stats', methods=['GET'])
+@read_only
 def get_dashboard_stats():
     if 'user_id' not in session:
         return jsonify({'error': 'Unauthorized'}), 401
 
-    user = User.query.get(session['user_id'])
+    user = get_current_user()
     if not user.is_admin():
         return jsonify({'error': 'Unauthorized'}), 403
 
@@ -840,6 +1168,105 @@ def get_dashboard_stats():
         'payroll_generated': current_month_payroll > 0
     })
 
+@app.route('/admin/api/db-pool')
+def db_pool_stats():
+    if 'user_id' not in session:
+        return jsonify({'error': 'Unauthorized'}), 401
+    user = get_current_user()
+    if not user.is_admin():
+        return jsonify({'error': 'Unauthorized'}), 403
+
+    stats = metrics.pool_stats(db.engine)
+    if replica.replica_configured(app):
+        stats['replica'] = dict(
+            metrics.pool_stats(db.get_engine(app, bind=REPLICA_BIND)),
+            **replica.monitor.status()
+        )
+    return jsonify(stats)
+
+@app.route('/admin/api/sql-stats', methods=['GET', 'DELETE'])
+def sql_stats():
+    if 'user_id' not in session:
+        return jsonify({'error': 'Unauthorized'}), 401
+    user = get_current_user()
+    if not user.is_admin():
+        return jsonify({'error': 'Unauthorized'}), 403
+
+    if request.method == 'DELETE':
+        sql_instrumentation.endpoint_stats.reset()
+        return jsonify({'success': True})
+    return jsonify({'endpoints': sql_instrumentation.endpoint_stats.snapshot()})
+
+@app.cli.command('rebuild-attendance-rollup')
+def rebuild_attendance_rollup_command():
+    """Rebuild the monthly attendance rollup from raw attendance rows"""
+    rows = attendance_rollup.rebuild_rollups()
+    print(f'Rebuilt {rows} monthly attendance rollup rows')
+
+@app.cli.command('render-payslips')
+@click.argument('pay_period_start', type=click.DateTime(formats=['%Y-%m-%d']))
+@click.argument('pay_period_end', type=click.DateTime(formats=['%Y-%m-%d']))
+@click.argument('output')
+@click.option('--workers', type=int, default=None, help='Render processes (defaults to CPU count)')
+def render_payslips_command(pay_period_start, pay_period_end, output, workers):
+    """Render PDF payslips for a pay period into OUTPUT (a .zip file or a directory)"""
+    def report(done, total):
+        print(f'\rRendered {done}/{total} payslips', end='', flush=True)
+
+    result = payslips.render_payslips(
+        pay_period_start.date(),
+        pay_period_end.date(),
+        output,
+        app.config['PAYSLIP_CACHE_DIR'],
+        progress=report,
+        max_workers=workers
+    )
+    print(f'\nWrote {result.total} payslips to {result.output} ({result.rendered} rendered, {result.cached} cached)')
+
+@app.cli.command('archive-history')
+@click.option('--months', type=int, default=24, help='Months of paid attendance to keep in the hot table')
+@click.option('--audit-months', type=int, default=12, help='Months of audit log to keep in the hot table')
+@click.option('--dry-run', is_flag=True, help='Only count the rows that would be archived')
+def archive_history_command(months, audit_months, dry_run):
+    """Move closed attendance and old audit log months into per-year archive tables"""
+    for source_name, retain in (('attendance', months), ('audit_log', audit_months)):
+        moved = archive.archive_closed_months(source_name, retain, dry_run=dry_run)
+        for month, rows in moved:
+            print(f'{source_name} {month:%Y-%m}: {rows} rows {"to archive" if dry_run else "archived"}')
+        print(f'{source_name}: {sum(rows for _, rows in moved)} rows {"to archive" if dry_run else "archived"}')
+
+def _department_id(name):
+    if name is None:
+        return None
+    department = Department.query.filter_by(name=name).first()
+    if department is None:
+        raise click.BadParameter(f'No department named {name}', param_hint='--department')
+    return department.id
+
+@app.cli.command('add-holiday')
+@click.argument('day', type=click.DateTime(formats=['%Y-%m-%d']))
+@click.argument('name')
+@click.option('--department', help='Department name (default: company-wide)')
+def add_holiday_command(day, name, department):
+    """Add a non-working day to the company or a department calendar"""
+    Holiday.create(date=day.date(), name=name, department_id=_department_id(department))
+    print(f'Added holiday {day.date().isoformat()} {name}')
+
+@app.cli.command('set-weekly-off')
+@click.argument('weekdays', nargs=-1, type=click.IntRange(0, 6))
+@click.option('--department', help='Department name (default: company-wide)')
+def set_weekly_off_command(weekdays, department):
+    """Replace the weekly days off (0 = Monday ... 6 = Sunday) of the company or a department"""
+    department_id = _department_id(department)
+    WeeklyOffRule.query.filter_by(department_id=department_id).delete()
+    db.session.add_all([WeeklyOffRule(department_id=department_id, weekday=weekday) for weekday in sorted(set(weekdays))])
+    db.session.commit()
+    work_calendar.invalidate()
+    if department and not weekdays:
+        print(f'{department} now follows the company weekly days off')
+    else:
+        print(f'Weekly days off: {", ".join(calendar.day_name[weekday] for weekday in sorted(set(weekdays))) or "none"}')
+
 if __name__ == '__main__':
     with app.app_context():
         db.create_all()
@@ -0,0 +1,247 @@
+"""
+Time-partitioned archival of attendance and audit history
+Closed months are moved from the hot attendance and audit_log tables into
+per-year archive tables (attendance_archive_2024, audit_log_archive_2024, ...).
+The hot tables keep only recent rows, so their indexes stay small. An
+attendance row is closed once it is older than the retention period and a
+paid payout covers its date; audit rows only need to be old enough. Monthly
+attendance rollups are left in place.
+
+ArchivePartition records which archive tables exist and the watermark below
+which rows may have been archived. The read helpers only touch the archive
+when a requested range starts before that watermark.
+"""
+
+from datetime import date, datetime
+
+from sqlalchemy import Column, Index, MetaData, Table, and_, exists, func, select, union_all
+
+from models import db, Attendance, AuditLog, MonthlyPayout, ArchivePartition
+
+archive_metadata = MetaData()
+
+# Users per IN list when looking up archived attendance days
+KEY_CHUNK_SIZE = 500
+
+# source table name -> (model, column that decides the partition)
+ARCHIVED_TABLES = {
+    'attendance': (Attendance, 'date'),
+    'audit_log': (AuditLog, 'created_at'),
+}
+
+
+class ArchivedDateError(ValueError):
+    """Raised when a write targets a row that has already been archived"""
+
+
+def _month_start(day, months_back=0):
+    index = day.year * 12 + day.month - 1 - months_back
+    return date(index // 12, index % 12 + 1, 1)
+
+
+def _bound(source_name, day):
+    """Compare datetime columns against midnight of the given date"""
+    if day is not None and ARCHIVED_TABLES[source_name][1] == 'created_at':
+        return datetime(day.year, day.month, day.day)
+    return day
+
+
+def archive_table(source_name, year):
+    """The Table object for one year's archive of a hot table"""
+    name = f'{source_name}_archive_{year}'
+    if name in archive_metadata.tables:
+        return archive_metadata.tables[name]
+
+    model, date_column = ARCHIVED_TABLES[source_name]
+    # No primary key: SQLite may hand a deleted id to a new hot row, which
+    # can later be archived next to the original
+    columns = [Column(column.name, column.type, nullable=column.nullable) for column in model.__table__.columns]
+    table = Table(name, archive_metadata, *columns)
+    Index(f'ix_{name}_{date_column}', table.c[date_column])
+    Index(f'ix_{name}_user_id', table.c.user_id)
+    return table
+
+
+def watermark(source_name, connection=None):
+    """Date before which rows may be in the archive, or None if nothing was archived"""
+    partitions = ArchivePartition.__table__
+    return (connection or db.session).execute(
+        select(func.max(partitions.c.archived_before)).where(partitions.c.source_table == source_name)
+    ).scalar()
+
+
+def _archived_years(connection, source_name, start, end):
+    partitions = ArchivePartition.__table__
+    query = select(partitions.c.year).where(partitions.c.source_table == source_name)
+    if start is not None:
+        query = query.where(partitions.c.year >= start.year)
+    if end is not None:
+        query = query.where(partitions.c.year <= end.year)
+    return sorted(year for year, in connection.execute(query))
+
+
+def source(source_name, start=None, end=None, connection=None):
+    """Selectable over the hot table plus any archive years the range needs.
+
+    start and end are inclusive dates; None leaves that side open. The result
+    has the hot table's columns, so callers can aggregate or filter it like
+    the table itself. connection defaults to the session.
+    """
+    connection = connection or db.session
+    model, date_column = ARCHIVED_TABLES[source_name]
+    hot = model.__table__
+
+    def in_range(table):
+        query = select(*[table.c[column.name] for column in hot.columns])
+        if start is not None:
+            query = query.where(table.c[date_column] >= _bound(source_name, start))
+        if end is not None:
+            query = query.where(table.c[date_column] < _bound(source_name, date.fromordinal(end.toordinal() + 1)))
+        return query
+
+    mark = watermark(source_name, connection)
+    if mark is None or (start is not None and start >= mark):
+        return in_range(hot).subquery(f'{source_name}_rows')
+
+    archive_end = min(end, mark) if end is not None else mark
+    parts = [in_range(hot)] + [
+        in_range(archive_table(source_name, year))
+        for year in _archived_years(connection, source_name, start, archive_end)
+    ]
+    return union_all(*parts).subquery(f'{source_name}_rows')
+
+
+def attendance_rows(user_id=None, start=None, end=None):
+    """Attendance rows for a range from the hot table and, when needed, the archive"""
+    attendance = source('attendance', start, end)
+    query = select(attendance)
+    if user_id is not None:
+        query = query.where(attendance.c.user_id == user_id)
+    return db.session.execute(query.order_by(attendance.c.date)).fetchall()
+
+
+def archived_attendance(keys, connection=None):
+    """The (user_id, date) pairs among keys that are already in the attendance archive.
+
+    The hot table's unique constraint cannot see archived rows, so writers
+    check here before re-inserting a day. Only keys before the watermark
+    cost a query.
+    """
+    connection = connection or db.session
+    mark = watermark('attendance', connection)
+    keys = {(user_id, day) for user_id, day in keys if mark is not None and day < mark}
+    if not keys:
+        return set()
+
+    archived = set()
+    first, last = min(day for _, day in keys), max(day for _, day in keys)
+    for year in _archived_years(connection, 'attendance', first, last):
+        table = archive_table('attendance', year)
+        user_ids = sorted({user_id for user_id, day in keys if day.year == year})
+        days = sorted({day for user_id, day in keys if day.year == year})
+        for i in range(0, len(user_ids), KEY_CHUNK_SIZE):
+            rows = connection.execute(
+                select(table.c.user_id, table.c.date)
+                .where(table.c.user_id.in_(user_ids[i:i + KEY_CHUNK_SIZE]), table.c.date.in_(days))
+            )
+            archived.update(key for key in map(tuple, rows) if key in keys)
+    return archived
+
+
+def audit_rows(table_name=None, record_id=None, start=None, end=None):
+    """Audit log rows for a range from the hot table and, when needed, the archive"""
+    audit_log = source('audit_log', start, end)
+    query = select(audit_log)
+    if table_name is not None:
+        query = query.where(audit_log.c.table_name == table_name)
+    if record_id is not None:
+        query = query.where(audit_log.c.record_id == record_id)
+    return db.session.execute(query.order_by(audit_log.c.created_at)).fetchall()
+
+
+def _month_criteria(source_name, table, month_start, month_end):
+    column = table.c[ARCHIVED_TABLES[source_name][1]]
+    return and_(column >= _bound(source_name, month_start), column < _bound(source_name, month_end))
+
+
+def _closed_criteria(source_name, table, month_start, month_end):
+    criteria = _month_criteria(source_name, table, month_start, month_end)
+    if source_name != 'attendance':
+        return criteria
+    payout = MonthlyPayout.__table__
+    # Only days already settled by a paid payout are closed
+    return and_(criteria, exists().where(
+        payout.c.user_id == table.c.user_id,
+        payout.c.pay_period_start <= table.c.date,
+        payout.c.pay_period_end >= table.c.date,
+        payout.c.status == 'paid'
+    ))
+
+
+def _oldest_month(connection, source_name):
+    model, date_column = ARCHIVED_TABLES[source_name]
+    oldest = connection.execute(select(func.min(model.__table__.c[date_column]))).scalar()
+    return _month_start(oldest) if oldest is not None else None
+
+
+def _record_partition(connection, source_name, year, moved, archived_before):
+    partitions = ArchivePartition.__table__
+    where = (partitions.c.source_table == source_name) & (partitions.c.year == year)
+    current = connection.execute(select(partitions.c.archived_before).where(where)).first()
+    if current is None:
+        connection.execute(partitions.insert().values(
+            source_table=source_name, year=year, archive_table=archive_table(source_name, year).name,
+            row_count=moved, archived_before=archived_before, updated_at=datetime.utcnow()
+        ))
+        return
+    connection.execute(partitions.update().where(where).values(
+        row_count=partitions.c.row_count + moved,
+        archived_before=max(current.archived_before, archived_before),
+        updated_at=datetime.utcnow()
+    ))
+
+
+def archive_closed_months(source_name, retain_months, today=None, dry_run=False):
+    """Move closed months older than retain_months into the archive.
+
+    Months are visited from the oldest row still in the hot table, so
+    attendance that was unpaid on an earlier run is picked up once its payout
+    is paid. Each month moves in its own transaction. Returns
+    [(month_start, rows moved), ...] for the months that had closed rows.
+    """
+    model, _ = ARCHIVED_TABLES[source_name]
+    hot = model.__table__
+    cutoff = _month_start(today or date.today(), retain_months)
+    moved_by_month = []
+
+    with db.engine.connect() as connection:
+        month = _oldest_month(connection, source_name)
+
+    while month is not None and month < cutoff:
+        next_month = _month_start(month, -1)
+        criteria = _closed_criteria(source_name, hot, month, next_month)
+
+        if dry_run:
+            with db.engine.connect() as connection:
+                moved = connection.execute(select(func.count()).select_from(hot).where(criteria)).scalar()
+        else:
+            archive = archive_table(source_name, month.year)
+            with db.engine.begin() as connection:
+                archive.create(connection, checkfirst=True)
+                connection.execute(archive.insert().from_select(
+                    [column.name for column in hot.columns],
+                    select(*hot.columns).where(criteria)
+                ))
+                # Remove only rows whose copy is in the archive
+                archived_ids = select(archive.c.id).where(_month_criteria(source_name, archive, month, next_month))
+                moved = connection.execute(
+                    hot.delete().where(criteria, hot.c.id.in_(archived_ids))
+                ).rowcount
+                if moved:
+                    _record_partition(connection, source_name, month.year, moved, next_month)
+
+        if moved:
+            moved_by_month.append((month, moved))
+        month = next_month
+
+    return moved_by_month
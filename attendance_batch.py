@@ -0,0 +1,161 @@
+"""
+Set-based attendance upserts
+Writes a whole roster of attendance rows against the unique_user_date
+constraint in a few statements instead of one lookup and commit per
+employee. SQLite and PostgreSQL use INSERT ... ON CONFLICT DO UPDATE; other
+databases look up the existing rows and then update and insert them as two
+executemany batches. The monthly rollup is refreshed in the same transaction.
+"""
+
+from datetime import datetime
+
+from sqlalchemy import bindparam, select
+from sqlalchemy.dialects import postgresql, sqlite
+
+import archive
+import attendance_rollup
+from models import db, User, Attendance
+
+# Rows per statement; keeps bound parameters under MS SQL Server's 2100 limit
+UPSERT_CHUNK_SIZE = 250
+
+UPSERT_DIALECTS = {
+    'sqlite': sqlite.insert,
+    'postgresql': postgresql.insert,
+}
+
+
+class InvalidAttendanceEntry(ValueError):
+    """Raised when a batch entry is malformed or names an unknown employee"""
+
+
+def parse_entries(entries, attendance_date):
+    """Validate [{user_id, present, hours_worked, notes}, ...] into row dicts.
+
+    A user listed more than once keeps its last entry.
+    """
+    if not isinstance(entries, list):
+        raise InvalidAttendanceEntry('entries must be a list')
+
+    rows = {}
+    for position, entry in enumerate(entries):
+        try:
+            user_id = int(entry['user_id'])
+            hours_worked = float(entry.get('hours_worked') or 0)
+        except (KeyError, TypeError, ValueError):
+            raise InvalidAttendanceEntry(f'Entry {position}: user_id and a numeric hours_worked are required')
+        if not 0 <= hours_worked <= 24:
+            raise InvalidAttendanceEntry(f'Entry {position}: hours_worked must be between 0 and 24')
+        present = entry.get('present', False)
+        # bool('false') is True; only accept real JSON booleans
+        if not isinstance(present, bool):
+            raise InvalidAttendanceEntry(f'Entry {position}: present must be true or false')
+
+        rows[user_id] = {
+            'user_id': user_id,
+            'date': attendance_date,
+            'present': present,
+            'hours_worked': hours_worked,
+            'notes': entry.get('notes') or ''
+        }
+
+    _check_users_exist(sorted(rows))
+    return list(rows.values())
+
+
+def _check_users_exist(user_ids):
+    known = set()
+    for i in range(0, len(user_ids), attendance_rollup.KEY_CHUNK_SIZE):
+        chunk = user_ids[i:i + attendance_rollup.KEY_CHUNK_SIZE]
+        known.update(user_id for user_id, in db.session.query(User.id).filter(User.id.in_(chunk)))
+    unknown = [user_id for user_id in user_ids if user_id not in known]
+    if unknown:
+        raise InvalidAttendanceEntry(f'Unknown employees: {", ".join(map(str, unknown[:20]))}')
+
+
+def _upsert_on_conflict(connection, insert, rows):
+    for i in range(0, len(rows), UPSERT_CHUNK_SIZE):
+        stmt = insert(Attendance.__table__).values(rows[i:i + UPSERT_CHUNK_SIZE])
+        connection.execute(stmt.on_conflict_do_update(
+            index_elements=['user_id', 'date'],
+            set_={
+                'present': stmt.excluded.present,
+                'hours_worked': stmt.excluded.hours_worked,
+                'notes': stmt.excluded.notes,
+                'updated_at': stmt.excluded.updated_at
+            }
+        ))
+
+
+def _upsert_lookup_then_write(connection, rows):
+    attendance = Attendance.__table__
+    existing = {}
+    for attendance_date in {row['date'] for row in rows}:
+        user_ids = [row['user_id'] for row in rows if row['date'] == attendance_date]
+        for i in range(0, len(user_ids), attendance_rollup.KEY_CHUNK_SIZE):
+            chunk = user_ids[i:i + attendance_rollup.KEY_CHUNK_SIZE]
+            existing.update(
+                ((user_id, attendance_date), row_id)
+                for row_id, user_id in connection.execute(
+                    select(attendance.c.id, attendance.c.user_id)
+                    .where(attendance.c.date == attendance_date, attendance.c.user_id.in_(chunk))
+                )
+            )
+
+    updates = [
+        dict(row, row_id=existing[(row['user_id'], row['date'])])
+        for row in rows if (row['user_id'], row['date']) in existing
+    ]
+    inserts = [row for row in rows if (row['user_id'], row['date']) not in existing]
+
+    if updates:
+        connection.execute(
+            attendance.update()
+            .where(attendance.c.id == bindparam('row_id'))
+            .values(
+                present=bindparam('present'),
+                hours_worked=bindparam('hours_worked'),
+                notes=bindparam('notes'),
+                updated_at=bindparam('updated_at')
+            ),
+            [{key: row[key] for key in ('row_id', 'present', 'hours_worked', 'notes', 'updated_at')}
+             for row in updates]
+        )
+    if inserts:
+        connection.execute(attendance.insert(), inserts)
+
+
+def upsert_attendance(rows):
+    """Insert or update attendance rows in the current session's transaction.
+
+    The caller commits. Returns the number of rows written. Raises
+    archive.ArchivedDateError if any row's day is already in the archive.
+    """
+    if not rows:
+        return 0
+
+    now = datetime.utcnow()
+    rows = [dict(row, status='pending', created_at=now, updated_at=now) for row in rows]
+
+    # Flush pending ORM changes so the rollup refresh below sees one consistent state
+    db.session.flush()
+    connection = db.session.connection()
+    archived = archive.archived_attendance({(row['user_id'], row['date']) for row in rows}, connection)
+    if archived:
+        user_id, day = min(archived)
+        raise archive.ArchivedDateError(
+            f'Attendance for employee {user_id} on {day} is archived and can no longer be changed'
+        )
+
+    insert = UPSERT_DIALECTS.get(connection.dialect.name)
+    if insert is not None:
+        _upsert_on_conflict(connection, insert, rows)
+    else:
+        _upsert_lookup_then_write(connection, rows)
+
+    # Core statements bypass the session events that maintain the rollup
+    attendance_rollup.refresh_rollups(
+        connection,
+        {(row['user_id'], row['date'].year, row['date'].month) for row in rows}
+    )
+    return len(rows)
@@ -0,0 +1,96 @@
+"""
+Attendance bitsets
+Answers "how many days was this employee present between A and B" from
+the present_mask column of attendance_monthly: one 32-bit mask per user
+per month, with bit day-1 set for each day present. attendance_rollup keeps
+the masks in step with every attendance write. A year-to-date count reads
+at most twelve rows per employee and popcounts them, instead of scanning
+daily attendance. Department-wide per-day counts stack the masks in a NumPy
+array and sum one bit column per day.
+"""
+
+from datetime import date
+
+import numpy as np
+
+from attendance_rollup import ensure_built, month_bounds, month_range
+from models import db, AttendanceMonthly, user_departments
+from work_calendar import clip_mask, work_calendar
+
+
+def _period_filter(start, end):
+    period_index = AttendanceMonthly.year * 12 + AttendanceMonthly.month
+    return [
+        period_index >= start.year * 12 + start.month,
+        period_index <= end.year * 12 + end.month
+    ]
+
+
+def load_masks(start, end, user_ids=None, department_id=None):
+    """Return {user_id: {(year, month): mask clipped to start..end}} in one query"""
+    ensure_built()
+    query = db.session.query(
+        AttendanceMonthly.user_id,
+        AttendanceMonthly.year,
+        AttendanceMonthly.month,
+        AttendanceMonthly.present_mask
+    ).filter(*_period_filter(start, end))
+    if user_ids is not None:
+        query = query.filter(AttendanceMonthly.user_id.in_(user_ids))
+    if department_id is not None:
+        query = query.join(user_departments, user_departments.c.user_id == AttendanceMonthly.user_id).filter(
+            user_departments.c.department_id == department_id
+        )
+
+    masks = {}
+    for user_id, year, month, mask in query:
+        masks.setdefault(user_id, {})[(year, month)] = clip_mask(mask or 0, year, month, start, end)
+    return masks
+
+
+def present_days_by_user(start, end, user_ids=None):
+    """Return {user_id: days present between start and end inclusive}"""
+    return {
+        user_id: sum(mask.bit_count() for mask in months.values())
+        for user_id, months in load_masks(start, end, user_ids).items()
+    }
+
+
+def present_days(user_id, start, end):
+    """Days one employee was present between start and end inclusive"""
+    return present_days_by_user(start, end, [user_id]).get(user_id, 0)
+
+
+def present_working_days(user_id, start, end, department_id=None):
+    """Days present that were also working days in the department calendar"""
+    masks = load_masks(start, end, [user_id]).get(user_id, {})
+    return sum(
+        (masks.get((year, month), 0) & working).bit_count()
+        for year, month, working in work_calendar.month_masks(start, end, department_id)
+    )
+
+
+def period_bitmaps(start, end, user_ids=None):
+    """Return {user_id: bitmap} with bit i set when the user was present on start + i days"""
+    bitmaps = {}
+    for user_id, months in load_masks(start, end, user_ids).items():
+        bitmap = 0
+        for (year, month), mask in months.items():
+            offset = (date(year, month, 1) - start).days
+            bitmap |= mask << offset if offset >= 0 else mask >> -offset
+        bitmaps[user_id] = bitmap
+    return bitmaps
+
+
+def department_daily_presence(department_id, start, end):
+    """Return [(date, employees present), ...] for every day between start and end"""
+    masks = load_masks(start, end, department_id=department_id)
+    counts = []
+    for year, month in month_range(start.year, start.month, end.year, end.month):
+        month_masks = np.array([months.get((year, month), 0) for months in masks.values()], dtype=np.uint32)
+        first_day, last_day = month_bounds(year, month)
+        for day in range(max(start, first_day).day, min(end, last_day).day + 1):
+            present = ((month_masks >> np.uint32(day - 1)) & np.uint32(1)).sum()
+            counts.append((date(year, month, day), int(present)))
+    return counts
+
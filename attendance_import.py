@@ -0,0 +1,171 @@
+"""
+Streaming attendance import from CSV
+Reads device exports one row at a time and upserts Attendance in fixed-size
+chunks, committing after each chunk, so memory stays flat whatever the file
+size. Rows are keyed on (user_id, date), so importing the same file twice
+leaves the same data. Within a chunk the last row for a user and day wins.
+
+Expected columns: username, date (YYYY-MM-DD), and optionally present,
+hours_worked and notes.
+"""
+
+import csv
+import io
+from datetime import date
+
+import archive
+import attendance_batch
+from attendance_rollup import KEY_CHUNK_SIZE
+from models import db, User
+
+DEFAULT_CHUNK_SIZE = 1000
+# Keep the report small even when every row of a large file is bad
+MAX_REPORTED_ERRORS = 100
+
+REQUIRED_COLUMNS = {'username', 'date'}
+TRUE_VALUES = {'1', 'true', 'yes', 'y', 'present', 'p'}
+FALSE_VALUES = {'0', 'false', 'no', 'n', 'absent', 'a'}
+
+
+class ImportReport:
+    """Counts and the first MAX_REPORTED_ERRORS problems from one import"""
+
+    def __init__(self):
+        self.rows_read = 0
+        self.rows_imported = 0
+        self.chunks_committed = 0
+        self.error_count = 0
+        self.errors = []
+
+    def add_error(self, line, message):
+        self.error_count += 1
+        if len(self.errors) < MAX_REPORTED_ERRORS:
+            self.errors.append((line, message))
+
+    @property
+    def errors_truncated(self):
+        return self.error_count > len(self.errors)
+
+
+class InvalidImportFile(ValueError):
+    """Raised when the file is not a CSV with the expected header"""
+
+
+def read_rows(stream):
+    """Yield (line_number, row dict) from a binary CSV stream without loading it"""
+    text = io.TextIOWrapper(stream, encoding='utf-8-sig', newline='')
+    reader = csv.DictReader(text)
+    columns = {name.strip().lower() for name in reader.fieldnames or []}
+    missing = REQUIRED_COLUMNS - columns
+    if missing:
+        raise InvalidImportFile(f'Missing columns: {", ".join(sorted(missing))}')
+
+    for row in reader:
+        # Extra unnamed fields land under a None key; ignore them
+        yield reader.line_num, {key.strip().lower(): (value or '').strip() for key, value in row.items() if key is not None}
+
+
+def _parse_row(row):
+    """Return (username, values) or raise ValueError with a readable message"""
+    username = row.get('username')
+    if not username:
+        raise ValueError('username is empty')
+    try:
+        attendance_date = date.fromisoformat(row.get('date', ''))
+    except ValueError:
+        raise ValueError(f"invalid date '{row.get('date', '')}'")
+
+    hours = row.get('hours_worked') or '0'
+    try:
+        hours_worked = float(hours)
+    except ValueError:
+        raise ValueError(f"invalid hours_worked '{hours}'")
+    if not 0 <= hours_worked <= 24:
+        raise ValueError('hours_worked must be between 0 and 24')
+
+    present = row.get('present')
+    if not present:
+        present = hours_worked > 0
+    elif present.lower() in TRUE_VALUES:
+        present = True
+    elif present.lower() in FALSE_VALUES:
+        present = False
+    else:
+        raise ValueError(f"invalid present value '{present}'")
+
+    return username, {
+        'date': attendance_date,
+        'present': present,
+        'hours_worked': hours_worked,
+        'notes': row.get('notes', '')
+    }
+
+
+def _resolve_usernames(usernames, user_ids):
+    """Add ids for usernames not yet in the user_ids cache"""
+    missing = sorted(username for username in usernames if username not in user_ids)
+    for i in range(0, len(missing), KEY_CHUNK_SIZE):
+        chunk = missing[i:i + KEY_CHUNK_SIZE]
+        user_ids.update(db.session.query(User.username, User.id).filter(User.username.in_(chunk)))
+
+
+def _flush_chunk(chunk, user_ids, report):
+    _resolve_usernames({username for _, username, _ in chunk}, user_ids)
+
+    rows = {}
+    lines = {}
+    for line, username, values in chunk:
+        user_id = user_ids.get(username)
+        if user_id is None:
+            report.add_error(line, f"unknown username '{username}'")
+            continue
+        rows[(user_id, values['date'])] = dict(values, user_id=user_id)
+        lines[(user_id, values['date'])] = line
+
+    for key in sorted(archive.archived_attendance(rows)):
+        report.add_error(lines[key], f'{key[1]} is archived and can no longer be changed')
+        del rows[key]
+
+    try:
+        attendance_batch.upsert_attendance(list(rows.values()))
+        db.session.commit()
+    except Exception as e:
+        db.session.rollback()
+        report.add_error(chunk[0][0], f'chunk ending at line {chunk[-1][0]} was not saved: {e}')
+        return
+
+    report.rows_imported += len(rows)
+    report.chunks_committed += 1
+
+
+def import_attendance(stream, chunk_size=DEFAULT_CHUNK_SIZE):
+    """Import a CSV stream and return an ImportReport"""
+    report = ImportReport()
+    # username -> id; bounded by the number of employees, not the file size
+    user_ids = {}
+    chunk = []
+    line = 1
+
+    try:
+        for line, row in read_rows(stream):
+            report.rows_read += 1
+            try:
+                username, values = _parse_row(row)
+            except ValueError as e:
+                report.add_error(line, str(e))
+                continue
+
+            chunk.append((line, username, values))
+            if len(chunk) >= chunk_size:
+                _flush_chunk(chunk, user_ids, report)
+                chunk = []
+    except UnicodeDecodeError as e:
+        # Nothing was saved yet, so the caller can reject the file as a whole
+        if not report.rows_read:
+            raise
+        # Earlier chunks are already committed; report where reading stopped
+        report.add_error(line + 1, f'not valid UTF-8 ({e.reason}); the rest of the file was not read')
+
+    if chunk:
+        _flush_chunk(chunk, user_ids, report)
+    return report
@@ -0,0 +1,251 @@
+"""
+Monthly attendance rollup maintenance
+Keeps attendance_monthly in step with Attendance inside the same transaction
+as the write, so reports read one row per employee per month instead of
+rescanning daily rows. Each rollup row also carries present_mask, a bitset
+with bit day-1 set for every day present (see attendance_bitsets).
+"""
+
+import calendar
+from datetime import date, datetime
+
+from sqlalchemy import event, func, case, select, inspect, and_, or_
+from sqlalchemy.orm import Session
+
+import archive
+from models import db, User, EmployeeDetails, Attendance, AttendanceMonthly, RollupState
+
+# Keep IN lists well under the 2100 parameter limit of MS SQL Server
+KEY_CHUNK_SIZE = 500
+
+# Bump when attendance_monthly gains a column that existing rows lack (2: present_mask)
+ROLLUP_VERSION = 2
+
+
+class RollupNotBuilt(Exception):
+    """Raised when attendance exists but the monthly rollup was never built"""
+
+
+def month_bounds(year, month):
+    """First and last day of a month"""
+    _, last_day = calendar.monthrange(year, month)
+    return date(year, month, 1), date(year, month, last_day)
+
+
+def month_range(start_year, start_month, end_year, end_month):
+    """Return [(year, month), ...] from the start month through the end month inclusive"""
+    months = []
+    year, month = start_year, start_month
+    while (year, month) <= (end_year, end_month):
+        months.append((year, month))
+        year, month = (year + 1, 1) if month == 12 else (year, month + 1)
+    return months
+
+
+def whole_months(start, end):
+    """Return [(year, month), ...] if start..end covers whole months exactly, else None"""
+    if start.day != 1 or end != month_bounds(end.year, end.month)[1] or end < start:
+        return None
+    return month_range(start.year, start.month, end.year, end.month)
+
+
+def _aggregate_columns(attendance):
+    # A CASE lookup instead of a shift or power(), which not every backend has;
+    # each user has one row per day, so summing the day bits sets them
+    day_bit = case({day: 1 << (day - 1) for day in range(1, 32)}, value=func.extract('day', attendance.c.date), else_=0)
+    return [
+        func.sum(case((attendance.c.present == True, 1), else_=0)),
+        func.coalesce(func.sum(attendance.c.hours_worked), 0.0),
+        func.sum(case((attendance.c.status == 'pending', 1), else_=0)),
+        func.sum(case((attendance.c.status == 'approved', 1), else_=0)),
+        func.coalesce(func.sum(case((attendance.c.present == True, day_bit), else_=0)), 0)
+    ]
+
+
+def refresh_rollups(connection, keys):
+    """Recompute the rollup rows for an iterable of (user_id, year, month) keys"""
+    rollup = AttendanceMonthly.__table__
+
+    by_month = {}
+    for user_id, year, month in keys:
+        by_month.setdefault((year, month), set()).add(user_id)
+
+    for (year, month), user_ids in sorted(by_month.items()):
+        first_day, last_day = month_bounds(year, month)
+        # Archived months are summed over the hot rows and the archive together
+        attendance = archive.source('attendance', first_day, last_day, connection)
+        user_ids = sorted(user_ids)
+        for i in range(0, len(user_ids), KEY_CHUNK_SIZE):
+            chunk = user_ids[i:i + KEY_CHUNK_SIZE]
+            rows = connection.execute(
+                select(attendance.c.user_id, *_aggregate_columns(attendance))
+                .where(attendance.c.user_id.in_(chunk))
+                .group_by(attendance.c.user_id)
+            ).fetchall()
+
+            connection.execute(
+                rollup.delete().where(
+                    rollup.c.year == year,
+                    rollup.c.month == month,
+                    rollup.c.user_id.in_(chunk)
+                )
+            )
+            if rows:
+                connection.execute(rollup.insert(), [
+                    {
+                        'user_id': user_id,
+                        'year': year,
+                        'month': month,
+                        'days_present': int(days_present or 0),
+                        'hours_worked': float(hours_worked or 0.0),
+                        'pending_count': int(pending or 0),
+                        'approved_count': int(approved or 0),
+                        'present_mask': int(present_mask or 0)
+                    }
+                    for user_id, days_present, hours_worked, pending, approved, present_mask in rows
+                ])
+
+
+def rebuild_rollups():
+    """Rebuild the whole rollup table from Attendance, archive included, in one transaction"""
+    rollup = AttendanceMonthly.__table__
+
+    with db.engine.begin() as connection:
+        attendance = archive.source('attendance', connection=connection)
+        year = func.extract('year', attendance.c.date)
+        month = func.extract('month', attendance.c.date)
+        connection.execute(rollup.delete())
+        connection.execute(
+            rollup.insert().from_select(
+                ['user_id', 'year', 'month', 'days_present', 'hours_worked', 'pending_count', 'approved_count',
+                 'present_mask'],
+                select(attendance.c.user_id, year, month, *_aggregate_columns(attendance))
+                .group_by(attendance.c.user_id, year, month)
+            )
+        )
+        _mark_built(connection)
+        return connection.execute(select(func.count()).select_from(rollup)).scalar()
+
+
+def _mark_built(connection):
+    """Record that attendance_monthly is complete at the current ROLLUP_VERSION"""
+    state = RollupState.__table__
+    values = {'version': ROLLUP_VERSION, 'built_at': datetime.utcnow()}
+    updated = connection.execute(
+        state.update().where(state.c.name == AttendanceMonthly.__tablename__).values(**values)
+    ).rowcount
+    if not updated:
+        connection.execute(state.insert().values(name=AttendanceMonthly.__tablename__, **values))
+
+
+def ensure_built():
+    """Refuse to read the rollup until it is known to be complete.
+
+    Databases upgraded from before the rollup, or from before present_mask,
+    have attendance the rollup does not reflect yet; months without rollup
+    rows would read as zero days. rebuild_rollups, or creating the tables on
+    an empty database, records the ROLLUP_VERSION the rollup was built at.
+    """
+    version = db.session.query(RollupState.version).filter_by(name=AttendanceMonthly.__tablename__).scalar()
+    if version is None or version < ROLLUP_VERSION:
+        raise RollupNotBuilt('The monthly attendance rollup is out of date; run "flask rebuild-attendance-rollup" first')
+
+
+@event.listens_for(db.Model.metadata, 'after_create')
+def _mark_new_database_built(metadata, connection, tables=(), **kw):
+    # A rollup created alongside an empty attendance table is complete by
+    # definition; anything else needs rebuild_rollups
+    if RollupState.__table__ in tables and connection.execute(
+            select(Attendance.__table__.c.id).limit(1)).first() is None:
+        _mark_built(connection)
+
+
+def load_month_totals(months, user_ids=None):
+    """Return {user_id: (days_present, hours_worked)} summed over [(year, month), ...]"""
+    ensure_built()
+    query = db.session.query(
+        AttendanceMonthly.user_id,
+        func.sum(AttendanceMonthly.days_present),
+        func.sum(AttendanceMonthly.hours_worked)
+    ).filter(
+        or_(*[and_(AttendanceMonthly.year == year, AttendanceMonthly.month == month) for year, month in months])
+    )
+    if user_ids is not None:
+        query = query.filter(AttendanceMonthly.user_id.in_(user_ids))
+    rows = query.group_by(AttendanceMonthly.user_id).all()
+    return {user_id: (int(days or 0), float(hours or 0.0)) for user_id, days, hours in rows}
+
+
+def load_monthly_report(months):
+    """Per-employee days present and hours for each month in one GROUP BY query.
+
+    Returns one row per employee with a daily rate: (user_id, name, is_hourly,
+    daily_rate, [(days_present, hours_worked) per month in months]).
+    """
+    ensure_built()
+    first_index = months[0][0] * 12 + months[0][1]
+    last_index = months[-1][0] * 12 + months[-1][1]
+    period_index = AttendanceMonthly.year * 12 + AttendanceMonthly.month
+
+    month_columns = []
+    for year, month in months:
+        in_month = and_(AttendanceMonthly.year == year, AttendanceMonthly.month == month)
+        month_columns.append(func.coalesce(func.sum(case((in_month, AttendanceMonthly.days_present), else_=0)), 0))
+        month_columns.append(func.coalesce(func.sum(case((in_month, AttendanceMonthly.hours_worked), else_=0.0)), 0.0))
+
+    rows = (
+        db.session.query(User.id, User.name, EmployeeDetails.is_hourly, User.daily_rate, *month_columns)
+        .outerjoin(EmployeeDetails, EmployeeDetails.user_id == User.id)
+        .outerjoin(AttendanceMonthly, and_(
+            AttendanceMonthly.user_id == User.id,
+            period_index >= first_index,
+            period_index <= last_index
+        ))
+        .filter(User.role == 'employee', User.daily_rate > 0)
+        .group_by(User.id, User.name, EmployeeDetails.is_hourly, User.daily_rate)
+        .order_by(User.name)
+        .all()
+    )
+
+    report = []
+    for user_id, name, is_hourly, daily_rate, *totals in rows:
+        per_month = [(int(totals[i] or 0), float(totals[i + 1] or 0.0)) for i in range(0, len(totals), 2)]
+        report.append((user_id, name, bool(is_hourly), daily_rate, per_month))
+    return report
+
+
+def _attendance_keys(instance, include_previous):
+    """Rollup keys an Attendance row contributes to, including pre-update values"""
+    keys = set()
+    if instance.user_id is not None and instance.date is not None:
+        keys.add((instance.user_id, instance.date.year, instance.date.month))
+    if include_previous:
+        state = inspect(instance)
+        user_ids = set(state.attrs.user_id.history.deleted) | {instance.user_id}
+        dates = set(state.attrs.date.history.deleted) | {instance.date}
+        for user_id in user_ids:
+            for day in dates:
+                if user_id is not None and day is not None:
+                    keys.add((user_id, day.year, day.month))
+    return keys
+
+
+@event.listens_for(Session, 'before_flush')
+def _collect_rollup_keys(session, flush_context, instances):
+    keys = session.info.setdefault('attendance_rollup_keys', set())
+    for instance in session.new:
+        if isinstance(instance, Attendance):
+            keys |= _attendance_keys(instance, include_previous=False)
+    for instance in session.dirty:
+        if isinstance(instance, Attendance) and session.is_modified(instance):
+            keys |= _attendance_keys(instance, include_previous=True)
+    for instance in session.deleted:
+        if isinstance(instance, Attendance):
+            keys |= _attendance_keys(instance, include_previous=True)
+
+
+@event.listens_for(Session, 'after_flush')
+def _apply_rollup_keys(session, flush_context):
+    keys = session.info.pop('attendance_rollup_keys', None)
+    if keys:
+        refresh_rollups(session.connection(), keys)
@@ -0,0 +1,185 @@
+"""
+Buffered audit trail
+CRUDMixin and the bulk payroll paths call record() once a change has been
+committed. Records are queued in memory and written to audit_log in batches
+by a background thread on its own connection. Auditing therefore never adds
+a commit, or more than a queue append, to the request that made the change.
+Request teardown wakes the writer, and anything still queued is flushed when
+the process exits.
+"""
+
+import atexit
+import json
+import logging
+import os
+import threading
+from datetime import datetime
+
+from flask import has_request_context, request, session
+
+logger = logging.getLogger(__name__)
+
+# Changes to these are recorded without their values
+REDACTED_COLUMNS = {'password_hash'}
+REDACTED = '[redacted]'
+
+
+def _to_json(values):
+    if values is None:
+        return None
+    return json.dumps(values, default=str, sort_keys=True)
+
+
+def redact(values):
+    return {key: REDACTED if key in REDACTED_COLUMNS else value for key, value in values.items()}
+
+
+def model_values(instance, keys=None):
+    """Column values of a model instance, with secrets redacted"""
+    columns = instance.__table__.columns.keys()
+    return redact({key: getattr(instance, key) for key in columns if keys is None or key in keys})
+
+
+class AuditWriter:
+    """Queue of pending audit rows plus the thread that writes them"""
+
+    def __init__(self):
+        self.engine = None
+        self.table = None
+        self.batch_size = 500
+        self.flush_interval = 1.0
+        self.max_pending = 50000
+        self.dropped = 0
+        self._pending = []
+        self._lock = threading.Lock()
+        self._wake = threading.Event()
+        self._thread = None
+        self._pid = None
+
+    @property
+    def enabled(self):
+        return self.engine is not None
+
+    def configure(self, engine, table, batch_size, flush_interval, max_pending):
+        self.engine = engine
+        self.table = table
+        self.batch_size = batch_size
+        self.flush_interval = flush_interval
+        self.max_pending = max_pending
+
+    def add(self, rows):
+        if not self.enabled or not rows:
+            return
+        with self._lock:
+            room = self.max_pending - len(self._pending)
+            if room < len(rows):
+                # The database has been unreachable for a while; keep the process healthy
+                self.dropped += len(rows) - max(room, 0)
+                logger.error('Audit buffer full, dropped %d records so far', self.dropped)
+                rows = rows[:max(room, 0)]
+            self._pending.extend(rows)
+            full = len(self._pending) >= self.batch_size
+        self._ensure_thread()
+        if full:
+            self._wake.set()
+
+    def wake(self):
+        if self._pending:
+            self._wake.set()
+
+    def flush(self):
+        """Write everything queued so far; returns the number of rows written"""
+        with self._lock:
+            rows, self._pending = self._pending, []
+        if not rows:
+            return 0
+        try:
+            with self.engine.begin() as connection:
+                for i in range(0, len(rows), self.batch_size):
+                    connection.execute(self.table.insert(), rows[i:i + self.batch_size])
+        except Exception:
+            logger.exception('Could not write %d audit records; will retry', len(rows))
+            with self._lock:
+                self._pending[:0] = rows[:self.max_pending - len(self._pending)]
+            return 0
+        return len(rows)
+
+    def _ensure_thread(self):
+        # Threads do not survive fork, so each gunicorn worker starts its own
+        if self._thread is not None and self._pid == os.getpid() and self._thread.is_alive():
+            return
+        with self._lock:
+            if self._thread is not None and self._pid == os.getpid() and self._thread.is_alive():
+                return
+            self._pid = os.getpid()
+            self._thread = threading.Thread(target=self._run, name='audit-writer', daemon=True)
+            self._thread.start()
+
+    def _run(self):
+        while True:
+            self._wake.wait(self.flush_interval)
+            self._wake.clear()
+            self.flush()
+
+
+writer = AuditWriter()
+atexit.register(writer.flush)
+
+
+def _request_details():
+    if not has_request_context():
+        return {'user_id': None, 'ip_address': None, 'user_agent': None}
+    return {
+        'user_id': session.get('user_id'),
+        'ip_address': request.remote_addr,
+        'user_agent': request.user_agent.string or None
+    }
+
+
+def record(action, table_name, record_id, old_values=None, new_values=None):
+    """Queue one audit record"""
+    record_many(action, table_name, [(record_id, old_values, new_values)])
+
+
+def record_many(action, table_name, changes):
+    """Queue audit records for [(record_id, old_values, new_values), ...]"""
+    if not writer.enabled:
+        return
+    details = _request_details()
+    now = datetime.utcnow()
+    writer.add([
+        dict(
+            details,
+            action=action,
+            table_name=table_name,
+            record_id=record_id,
+            old_values=_to_json(old_values),
+            new_values=_to_json(new_values),
+            created_at=now
+        )
+        for record_id, old_values, new_values in changes
+    ])
+
+
+def init_app(app):
+    """Start auditing with the app's primary engine"""
+    from models import db, AuditLog
+
+    app.config.setdefault('AUDIT_ENABLED', True)
+    app.config.setdefault('AUDIT_BATCH_SIZE', 500)
+    app.config.setdefault('AUDIT_FLUSH_INTERVAL', 1.0)
+    app.config.setdefault('AUDIT_MAX_PENDING', 50000)
+    if not app.config['AUDIT_ENABLED']:
+        return
+
+    writer.configure(
+        db.get_engine(app),
+        AuditLog.__table__,
+        app.config['AUDIT_BATCH_SIZE'],
+        app.config['AUDIT_FLUSH_INTERVAL'],
+        app.config['AUDIT_MAX_PENDING']
+    )
+
+    @app.teardown_request
+    def wake_audit_writer(exc):
+        writer.wake()
@@ -1,6 +1,39 @@
 # Database Configuration
 import os
 
-def get_database_uri():
-    """Get the database URI from environment or default to SQLite"""
-    return os.environ.get('DATABASE_URL', 'sqlite:///payroll.db')
\ No newline at end of file
+# MS SQL Server connection used by migrate_to_mssql.py and test_sqlserver.py
+MSSQL_CONFIG = {
+    'server': os.environ.get('SQL_SERVER', 'localhost'),
+    'database': os.environ.get('SQL_DATABASE', 'payroll_db'),
+    'username': os.environ.get('SQL_USER', 'sa'),
+    'password': os.environ.get('SQL_PASSWORD', ''),
+    'driver': os.environ.get('SQL_DRIVER', '{ODBC Driver 18 for SQL Server}')
+}
+
+def get_database_uri(replica=False):
+    """Get the database URI from environment or default to SQLite
+
+    With replica=True return the read replica's URI (DATABASE_REPLICA_URL), or
+    None when no replica is configured.
+    """
+    if replica:
+        return os.environ.get('DATABASE_REPLICA_URL') or None
+    return os.environ.get('DATABASE_URL', 'sqlite:///payroll.db')
+
+def get_engine_options(database_uri=None, pool_size=5, max_overflow=10):
+    """SQLAlchemy engine options for the connection pool, overridable from the environment
+
+    SQLite keeps SQLAlchemy's default pool, which does not take size options.
+    """
+    database_uri = database_uri or get_database_uri()
+    if database_uri.startswith('sqlite'):
+        return {}
+    return {
+        'pool_size': int(os.environ.get('DB_POOL_SIZE', pool_size)),
+        'max_overflow': int(os.environ.get('DB_MAX_OVERFLOW', max_overflow)),
+        # Seconds to wait for a free connection before raising
+        'pool_timeout': int(os.environ.get('DB_POOL_TIMEOUT', 30)),
+        # Replace connections before server or firewall idle timeouts drop them
+        'pool_recycle': int(os.environ.get('DB_POOL_RECYCLE', 1800)),
+        'pool_pre_ping': os.environ.get('DB_POOL_PRE_PING', 'true').lower() in ('1', 'true', 'yes'),
+    }
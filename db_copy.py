@@ -0,0 +1,250 @@
+#!/usr/bin/env python3
+"""
+Resumable database-to-database copier for the payroll schema
+Copies every model table between any two SQLAlchemy URLs (SQLite,
+PostgreSQL, MS SQL Server). Rows move in primary-key ranges. Each range is
+replaced in the target in one transaction and then recorded in a JSON
+checkpoint, so an interrupted run picks up at the first unfinished range.
+When the copy ends, every range is compared by row count and content hash.
+
+Usage: python db_copy.py SOURCE_URL TARGET_URL [--range-size N] [--checkpoint FILE]
+                         [--tables a,b] [--create-tables] [--verify-only] [--no-verify]
+"""
+
+import argparse
+import hashlib
+import json
+import os
+import sys
+from datetime import date, datetime, time, timedelta
+
+from sqlalchemy import create_engine, func, select, text
+from sqlalchemy.engine import make_url
+from sqlalchemy.types import Integer
+
+from models import db
+
+DEFAULT_RANGE_SIZE = 5000
+# Rows per INSERT executemany inside a range
+INSERT_BATCH_SIZE = 1000
+
+
+def _datetime_tick(value):
+    """Round a datetime to the 1/300 s tick MS SQL Server DATETIME stores.
+
+    The tick is expressed in whole milliseconds, so a value read back as
+    .003 or .007 matches the source value it was rounded from.
+    """
+    ticks = round(value.microsecond * 300 / 1000000)
+    return value.replace(microsecond=0, tzinfo=None) + timedelta(milliseconds=ticks * 10 // 3)
+
+
+def _normalize(value):
+    """Render a value the same way whichever database it was read from"""
+    if value is None:
+        return ''
+    if isinstance(value, bool):
+        return str(int(value))
+    if isinstance(value, datetime):
+        return _datetime_tick(value).isoformat()
+    if isinstance(value, (date, time)):
+        return value.isoformat()
+    if isinstance(value, float):
+        return repr(round(value, 6))
+    return str(value)
+
+
+def _integer_key(table):
+    """The single integer primary key column, or None when ranges cannot be used"""
+    columns = list(table.primary_key.columns)
+    if len(columns) == 1 and isinstance(columns[0].type, Integer):
+        return columns[0]
+    return None
+
+
+class Checkpoint:
+    """Progress per table, saved atomically after every committed range"""
+
+    def __init__(self, path, source_url, target_url, range_size):
+        self.path = path
+        self.identity = {'source': source_url, 'target': target_url, 'range_size': range_size}
+        self.tables = {}
+        if path and os.path.exists(path):
+            with open(path) as f:
+                saved = json.load(f)
+            if {key: saved.get(key) for key in self.identity} != self.identity:
+                raise SystemExit(f'{path} belongs to a different copy; remove it or pass another --checkpoint')
+            self.tables = saved['tables']
+
+    def table(self, name):
+        return self.tables.setdefault(name, {'next_key': None, 'rows': 0, 'done': False})
+
+    def save(self):
+        if not self.path:
+            return
+        partial = self.path + '.tmp'
+        with open(partial, 'w') as f:
+            json.dump(dict(self.identity, tables=self.tables), f, indent=2)
+        os.replace(partial, self.path)
+
+
+def key_ranges(connection, table, key, range_size):
+    """[(low, high), ...] half-open ranges covering the table's keys"""
+    low, high = connection.execute(select(func.min(key), func.max(key)).select_from(table)).one()
+    if low is None:
+        return []
+    return [(start, start + range_size) for start in range(low, high + 1, range_size)]
+
+
+def _insert_rows(connection, table, rows):
+    for i in range(0, len(rows), INSERT_BATCH_SIZE):
+        connection.execute(table.insert(), [dict(row._mapping) for row in rows[i:i + INSERT_BATCH_SIZE]])
+
+
+def _reset_sequence(target, table, key):
+    """Move a PostgreSQL serial past the copied keys"""
+    if target.dialect.name != 'postgresql':
+        return
+    with target.begin() as connection:
+        connection.execute(
+            text(f"SELECT setval(pg_get_serial_sequence(:table, :column), COALESCE(MAX({key.name}), 1)) "
+                 f'FROM "{table.name}"'),
+            {'table': table.name, 'column': key.name}
+        )
+
+
+def copy_table(source, target, table, checkpoint, range_size):
+    """Copy one table range by range, resuming from the checkpoint"""
+    progress = checkpoint.table(table.name)
+    if progress['done']:
+        print(f'{table.name}: already copied ({progress["rows"]} rows)')
+        return
+
+    key = _integer_key(table)
+    if key is None:
+        # No usable key: replace the whole table in one transaction
+        with source.connect() as src, target.begin() as dst:
+            rows = src.execute(select(table)).fetchall()
+            dst.execute(table.delete())
+            _insert_rows(dst, table, rows)
+        progress.update(rows=len(rows), done=True)
+        checkpoint.save()
+        print(f'{table.name}: copied {len(rows)} rows')
+        return
+
+    with source.connect() as src:
+        ranges = key_ranges(src, table, key, range_size)
+        for low, high in ranges:
+            if progress['next_key'] is not None and low < progress['next_key']:
+                continue
+            rows = src.execute(
+                select(table).where(key >= low, key < high).order_by(key)
+            ).fetchall()
+            # Deleting the range first makes a retried range idempotent
+            with target.begin() as dst:
+                dst.execute(table.delete().where(key >= low, key < high))
+                if rows:
+                    _insert_rows(dst, table, rows)
+            progress['next_key'] = high
+            progress['rows'] += len(rows)
+            checkpoint.save()
+            print(f'{table.name}: keys < {high} copied ({progress["rows"]} rows)')
+
+    _reset_sequence(target, table, key)
+    progress['done'] = True
+    checkpoint.save()
+
+
+def range_digest(connection, table, key=None, low=None, high=None):
+    """(row count, sha256 of the normalised rows) for a key range or the whole table"""
+    query = select(table)
+    if key is not None:
+        query = query.where(key >= low, key < high).order_by(key)
+    digest = hashlib.sha256()
+    rows = [
+        '\x1f'.join(_normalize(value) for value in row)
+        for row in connection.execute(query)
+    ]
+    if key is None:
+        # Without a key there is no shared order, so compare sorted rows
+        rows.sort()
+    for row in rows:
+        digest.update(row.encode())
+        digest.update(b'\x1e')
+    return len(rows), digest.hexdigest()
+
+
+def verify_table(source, target, table, range_size):
+    """Compare counts and hashes per range; return a list of mismatch descriptions"""
+    key = _integer_key(table)
+    mismatches = []
+    with source.connect() as src, target.connect() as dst:
+        ranges = [(None, None)] if key is None else key_ranges(src, table, key, range_size)
+        for low, high in ranges:
+            expected = range_digest(src, table, key, low, high)
+            actual = range_digest(dst, table, key, low, high)
+            if expected != actual:
+                where = 'all rows' if key is None else f'keys {low}-{high - 1}'
+                mismatches.append(f'{table.name} {where}: source {expected[0]} rows, target {actual[0]} rows'
+                                  + ('' if expected[0] != actual[0] else ', contents differ'))
+
+        if key is not None:
+            # Rows outside the source's key span must not exist in the target
+            outside = select(func.count()).select_from(table)
+            if ranges:
+                outside = outside.where((key < ranges[0][0]) | (key >= ranges[-1][1]))
+            extra = dst.execute(outside).scalar()
+            if extra:
+                mismatches.append(f'{table.name}: {extra} target rows outside the source key range')
+    return mismatches
+
+
+def main():
+    parser = argparse.ArgumentParser(description='Copy the payroll database between two SQLAlchemy URLs')
+    parser.add_argument('source_url')
+    parser.add_argument('target_url')
+    parser.add_argument('--range-size', type=int, default=DEFAULT_RANGE_SIZE, help='Primary keys per range')
+    parser.add_argument('--checkpoint', default='db_copy.checkpoint.json', help='Progress file used to resume')
+    parser.add_argument('--tables', help='Comma-separated tables to copy (default: all)')
+    parser.add_argument('--create-tables', action='store_true', help='Create missing tables in the target first')
+    parser.add_argument('--verify-only', action='store_true', help='Only compare source and target')
+    parser.add_argument('--no-verify', action='store_true', help='Skip the comparison after copying')
+    args = parser.parse_args()
+
+    source = create_engine(args.source_url)
+    target = create_engine(args.target_url)
+    tables = db.metadata.sorted_tables
+    if args.tables:
+        wanted = set(args.tables.split(','))
+        tables = [table for table in tables if table.name in wanted]
+
+    if args.create_tables:
+        db.metadata.create_all(target, tables=tables)
+
+    if not args.verify_only:
+        checkpoint = Checkpoint(
+            args.checkpoint,
+            make_url(args.source_url).render_as_string(hide_password=True),
+            make_url(args.target_url).render_as_string(hide_password=True),
+            args.range_size
+        )
+        for table in tables:
+            copy_table(source, target, table, checkpoint, args.range_size)
+
+    if args.no_verify:
+        return
+
+    mismatches = []
+    for table in tables:
+        table_mismatches = verify_table(source, target, table, args.range_size)
+        print(f'{table.name}: {"OK" if not table_mismatches else f"{len(table_mismatches)} mismatched ranges"}')
+        mismatches.extend(table_mismatches)
+
+    if mismatches:
+        print('\n'.join(mismatches))
+        sys.exit(1)
+    print('Source and target match')
+
+
+if __name__ == '__main__':
+    main()
@@ -0,0 +1,48 @@
+"""
+Gunicorn settings for the payroll app
+Prepares the shared Prometheus multiprocess directory and cleans up after
+workers exit so /metrics only reports live processes. With preload_app the
+app and its engine are created in the master, so each worker drops the
+inherited pool after fork and opens its own connections.
+"""
+
+import glob
+import os
+import sys
+
+bind = '0.0.0.0:8000'
+workers = 4
+preload_app = os.environ.get('GUNICORN_PRELOAD', 'false').lower() in ('1', 'true', 'yes')
+
+
+def _clear_multiproc_dir():
+    # Files left by a previous run would be merged into the new totals
+    multiproc_dir = os.environ.get('PROMETHEUS_MULTIPROC_DIR')
+    if multiproc_dir:
+        os.makedirs(multiproc_dir, exist_ok=True)
+        for path in glob.glob(os.path.join(multiproc_dir, '*.db')):
+            os.remove(path)
+
+
+# With preload_app gunicorn imports the app, and so defines the metrics, before
+# on_starting runs; clear the directory now, while this config is being loaded
+if preload_app:
+    _clear_multiproc_dir()
+
+
+def on_starting(server):
+    if not preload_app:
+        _clear_multiproc_dir()
+
+
+def post_fork(server, worker):
+    # Only set when the app was preloaded in the master
+    app_module = sys.modules.get('app')
+    if app_module is not None:
+        app_module.dispose_pool_after_fork()
+
+
+def child_exit(server, worker):
+    if os.environ.get('PROMETHEUS_MULTIPROC_DIR'):
+        from prometheus_client import multiprocess
+        multiprocess.mark_process_dead(worker.pid)
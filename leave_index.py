@@ -0,0 +1,87 @@
+"""
+Approved-leave interval index
+Loads the leave rows that touch a date range in one query and groups them
+into sorted intervals per user. Payroll uses the index for paid-leave day
+counts. Leave requests and approvals use it for overlap checks. Neither
+scans dates per employee: a leave is turned into a day bitmap over the
+period, ANDed with the work calendar's working days, and popcounted.
+"""
+
+from bisect import bisect_right
+from collections import namedtuple
+
+from models import db, Leave
+
+# Leave types that count toward days paid; anything else (e.g. 'unpaid') does not
+PAID_LEAVE_TYPES = frozenset({'sick', 'vacation', 'personal', 'maternity', 'paternity'})
+
+LeaveInterval = namedtuple('LeaveInterval', 'start_date end_date leave_id leave_type status')
+
+
+def _range_bits(start, end, period_start, period_end):
+    """Bits for start..end clipped to the period, where bit 0 is period_start"""
+    low = max(start, period_start)
+    high = min(end, period_end)
+    if high < low:
+        return 0
+    return ((1 << ((high - low).days + 1)) - 1) << (low - period_start).days
+
+
+class LeaveIndex:
+    """Per-user leave intervals sorted by start date"""
+
+    def __init__(self, intervals_by_user):
+        self._intervals = intervals_by_user
+        self._starts = {
+            user_id: [interval.start_date for interval in intervals]
+            for user_id, intervals in intervals_by_user.items()
+        }
+
+    @classmethod
+    def load(cls, start, end, statuses=('approved',), user_ids=None, exclude_leave_id=None):
+        """Index the leaves in the given statuses that overlap start..end"""
+        query = db.session.query(
+            Leave.user_id, Leave.start_date, Leave.end_date, Leave.id, Leave.leave_type, Leave.status
+        ).filter(
+            Leave.status.in_(statuses),
+            Leave.start_date <= end,
+            Leave.end_date >= start
+        )
+        if user_ids is not None:
+            query = query.filter(Leave.user_id.in_(user_ids))
+        if exclude_leave_id is not None:
+            query = query.filter(Leave.id != exclude_leave_id)
+
+        intervals = {}
+        for user_id, *row in query.order_by(Leave.user_id, Leave.start_date, Leave.id):
+            intervals.setdefault(user_id, []).append(LeaveInterval(*row))
+        return cls(intervals)
+
+    @property
+    def user_ids(self):
+        return list(self._intervals)
+
+    def overlapping(self, user_id, start, end):
+        """A user's intervals that share at least one day with start..end"""
+        intervals = self._intervals.get(user_id, [])
+        # Only intervals starting on or before end can overlap
+        candidates = intervals[:bisect_right(self._starts.get(user_id, []), end)]
+        return [interval for interval in candidates if interval.end_date >= start]
+
+    def paid_leave_days(self, user_id, period_start, period_end, working_bitmap, present_bitmap=0):
+        """Working days in the period covered by paid leave on which the user was not present.
+
+        working_bitmap and present_bitmap have bit i set for period_start + i days.
+        Overlapping leaves count each day once.
+        """
+        leave_bits = 0
+        for interval in self.overlapping(user_id, period_start, period_end):
+            if interval.leave_type in PAID_LEAVE_TYPES:
+                leave_bits |= _range_bits(interval.start_date, interval.end_date, period_start, period_end)
+        return (leave_bits & working_bitmap & ~present_bitmap).bit_count()
+
+
+def find_overlaps(user_id, start, end, exclude_leave_id=None):
+    """Pending or approved leaves of one user that overlap start..end"""
+    index = LeaveIndex.load(start, end, ('pending', 'approved'), [user_id], exclude_leave_id)
+    return index.overlapping(user_id, start, end)
@@ -0,0 +1,171 @@
+"""
+Prometheus metrics for the payroll app
+Tracks request latency per endpoint, in-flight requests, DB pool checkout
+waits and payroll job durations. When PROMETHEUS_MULTIPROC_DIR is set (as in
+the Docker image) every gunicorn worker writes to a shared directory and
+/metrics merges them, so the numbers cover all workers rather than whichever
+one served the scrape.
+"""
+
+import os
+import time
+
+# Metrics open their files in the multiprocess directory as soon as they are
+# defined, so it must exist for CLI commands too, not only under gunicorn
+if os.environ.get('PROMETHEUS_MULTIPROC_DIR'):
+    os.makedirs(os.environ['PROMETHEUS_MULTIPROC_DIR'], exist_ok=True)
+
+from flask import Response, g, request
+from prometheus_client import (
+    CONTENT_TYPE_LATEST, CollectorRegistry, Counter, Gauge, Histogram, generate_latest, multiprocess
+)
+from sqlalchemy import event
+from sqlalchemy.pool import QueuePool
+from sqlalchemy.util import queue as sqla_queue
+
+from models import db
+
+REQUEST_LATENCY = Histogram(
+    'payroll_http_request_duration_seconds',
+    'Time spent serving HTTP requests',
+    ['method', 'endpoint', 'status'],
+    buckets=(0.005, 0.01, 0.025, 0.05, 0.1, 0.25, 0.5, 1, 2.5, 5, 10, 30)
+)
+REQUESTS_IN_FLIGHT = Gauge(
+    'payroll_http_requests_in_flight',
+    'Requests currently being served',
+    ['endpoint'],
+    multiprocess_mode='livesum'
+)
+POOL_CHECKOUT_WAIT = Histogram(
+    'payroll_db_pool_checkout_wait_seconds',
+    'Time spent waiting in the DB pool queue for a free connection, excluding connect and pre-ping',
+    buckets=(0.0005, 0.001, 0.005, 0.01, 0.025, 0.05, 0.1, 0.25, 0.5, 1, 5, 30)
+)
+DB_CONNECTIONS_IN_USE = Gauge(
+    'payroll_db_connections_in_use',
+    'Connections currently checked out of the DB pool',
+    multiprocess_mode='livesum'
+)
+DB_CONNECTIONS_OPENED = Counter(
+    'payroll_db_connections_opened_total',
+    'New DB connections opened by the pool'
+)
+PAYROLL_JOB_DURATION = Histogram(
+    'payroll_job_duration_seconds',
+    'Wall time of payroll generation jobs',
+    ['status'],
+    buckets=(1, 5, 15, 30, 60, 120, 300, 600, 1200, 1800, 3600)
+)
+
+
+class _TimedQueue(sqla_queue.Queue):
+    """The pool's connection queue, timing each take"""
+
+    def get(self, block=True, timeout=None):
+        started = time.perf_counter()
+        try:
+            return super().get(block, timeout)
+        finally:
+            POOL_CHECKOUT_WAIT.observe(time.perf_counter() - started)
+
+
+class TimedQueuePool(QueuePool):
+    """QueuePool that records how long each checkout waits for a free connection.
+
+    Only the queue is timed: opening overflow connections and pre-ping
+    round trips happen outside it and are left out of the metric.
+    """
+
+    _queue_class = _TimedQueue
+
+
+def engine_options(database_uri):
+    """Engine options that route pool checkouts through TimedQueuePool.
+
+    SQLite keeps its default pool; it never queues for connections.
+    """
+    if database_uri.startswith('sqlite'):
+        return {}
+    return {'poolclass': TimedQueuePool}
+
+
+def instrument_pool(engine):
+    """Track connections in use and new connections opened by an engine's pool"""
+    if event.contains(engine, 'checkout', _on_checkout):
+        return
+    event.listen(engine, 'connect', _on_connect)
+    event.listen(engine, 'checkout', _on_checkout)
+    event.listen(engine, 'checkin', _on_checkin)
+
+
+def _on_connect(dbapi_connection, connection_record):
+    DB_CONNECTIONS_OPENED.inc()
+
+
+def _on_checkout(dbapi_connection, connection_record, connection_proxy):
+    DB_CONNECTIONS_IN_USE.inc()
+
+
+def _on_checkin(dbapi_connection, connection_record):
+    DB_CONNECTIONS_IN_USE.dec()
+
+
+def pool_stats(engine):
+    """Current pool state for this process"""
+    pool = engine.pool
+    stats = {'pool_class': type(pool).__name__, 'status': pool.status()}
+    if isinstance(pool, QueuePool):
+        stats.update(
+            size=pool.size(),
+            checked_in=pool.checkedin(),
+            checked_out=pool.checkedout(),
+            overflow=pool.overflow(),
+            timeout=pool.timeout()
+        )
+    return stats
+
+
+def _endpoint_label():
+    # Route names keep the label set bounded; unknown URLs share one label
+    return request.endpoint or 'unmatched'
+
+
+def _registry():
+    if os.environ.get('PROMETHEUS_MULTIPROC_DIR'):
+        registry = CollectorRegistry()
+        multiprocess.MultiProcessCollector(registry)
+        return registry
+    from prometheus_client import REGISTRY
+    return REGISTRY
+
+
+def init_app(app):
+    """Time every request and register the /metrics endpoint"""
+    for bind in [None] + list(app.config.get('SQLALCHEMY_BINDS') or {}):
+        instrument_pool(db.get_engine(app, bind=bind))
+
+    @app.before_request
+    def start_request_timer():
+        g.metrics_started = time.perf_counter()
+        g.metrics_endpoint = _endpoint_label()
+        REQUESTS_IN_FLIGHT.labels(g.metrics_endpoint).inc()
+
+    @app.teardown_request
+    def observe_request(exc):
+        started = g.pop('metrics_started', None)
+        if started is None:
+            return
+        endpoint = g.pop('metrics_endpoint')
+        status = g.pop('metrics_status', 500)
+        REQUESTS_IN_FLIGHT.labels(endpoint).dec()
+        REQUEST_LATENCY.labels(request.method, endpoint, str(status)).observe(time.perf_counter() - started)
+
+    @app.after_request
+    def record_status(response):
+        g.metrics_status = response.status_code
+        return response
+
+    @app.route('/metrics')
+    def metrics():
+        return Response(generate_latest(_registry()), mimetype=CONTENT_TYPE_LATEST)
@@ -2,15 +2,28 @@
 """
 MS SQL Server Migration Script for Payroll Management System
 Migrates data from SQLite to MS SQL Server
+
+By default tables are streamed from SQLite in batches and written with pyodbc
+fast_executemany, and tables that do not depend on each other are copied in
+parallel. --legacy keeps the original JSON export and row-by-row import.
+
+Usage: python migrate_to_mssql.py [--batch-size N] [--workers N] [--legacy]
 """
 
 import pyodbc
 import sqlite3
 import json
-from datetime import datetime, date
+import argparse
+import time as timer
+from concurrent.futures import ThreadPoolExecutor
+from datetime import datetime, date, time, timedelta
 import os
 from database_config import MSSQL_CONFIG
 
+# Rows per fetchmany/executemany round trip
+DEFAULT_BATCH_SIZE = 10000
+DEFAULT_WORKERS = 4
+
 def get_sqlite_connection():
     """Connect to SQLite database"""
     return sqlite3.connect('payroll.db')
@@ -192,6 +205,130 @@ def import_to_mssql(data):
     finally:
         mssql_conn.close()
 
+def table_waves(tables):
+    """Group tables into waves; each wave only references tables from earlier waves"""
+    names = {table.name for table in tables}
+    levels = {}
+
+    def level(table):
+        if table.name not in levels:
+            levels[table.name] = 0
+            parents = {fk.column.table for fk in table.foreign_keys if fk.column.table.name in names}
+            parents.discard(table)
+            levels[table.name] = 1 + max((level(parent) for parent in parents), default=-1)
+        return levels[table.name]
+
+    waves = {}
+    for table in tables:
+        waves.setdefault(level(table), []).append(table)
+    return [waves[index] for index in sorted(waves)]
+
+def _converter(column_type):
+    """Turn SQLite's text dates into Python values pyodbc can bind"""
+    from sqlalchemy import Date, DateTime, Time
+
+    if isinstance(column_type, DateTime):
+        def convert(value):
+            if isinstance(value, str):
+                value = datetime.fromisoformat(value)
+            if not value:
+                return value
+            # DATETIME stores 1/300 s ticks and fast_executemany overflows on
+            # finer values, so send the nearest tick in whole milliseconds
+            ticks = round(value.microsecond * 300 / 1000000)
+            return value.replace(microsecond=0) + timedelta(milliseconds=ticks * 10 // 3)
+        return convert
+    if isinstance(column_type, Date):
+        return lambda value: date.fromisoformat(value[:10]) if isinstance(value, str) else value
+    if isinstance(column_type, Time):
+        return lambda value: time.fromisoformat(value) if isinstance(value, str) else value
+    return None
+
+def copy_table(table, batch_size=DEFAULT_BATCH_SIZE):
+    """Stream one table from SQLite into MS SQL Server and return the rows copied"""
+    from sqlalchemy import Integer
+
+    sqlite_conn = get_sqlite_connection()
+    mssql_conn = get_mssql_connection()
+    started = timer.perf_counter()
+    try:
+        sqlite_cursor = sqlite_conn.cursor()
+        sqlite_cursor.execute(f'PRAGMA table_info("{table.name}")')
+        source_columns = {row[1] for row in sqlite_cursor.fetchall()}
+        columns = [column for column in table.columns if column.name in source_columns]
+        if not columns:
+            return 0
+
+        converters = [(index, _converter(column.type)) for index, column in enumerate(columns)]
+        converters = [(index, convert) for index, convert in converters if convert is not None]
+
+        column_list = ', '.join(f'[{column.name}]' for column in columns)
+        placeholders = ', '.join('?' for _ in columns)
+        insert_sql = f"INSERT INTO [{table.name}] ({column_list}) VALUES ({placeholders})"
+        select_sql = "SELECT {} FROM \"{}\"".format(', '.join(f'"{column.name}"' for column in columns), table.name)
+        # Integer surrogate keys become IDENTITY columns on MS SQL Server
+        primary_key = list(table.primary_key.columns)
+        identity = (len(primary_key) == 1 and primary_key[0] in columns and not primary_key[0].foreign_keys
+                    and isinstance(primary_key[0].type, Integer) and primary_key[0].autoincrement in (True, 'auto'))
+
+        mssql_cursor = mssql_conn.cursor()
+        mssql_cursor.fast_executemany = True
+        # IDENTITY_INSERT is per session, so every table gets its own connection
+        if identity:
+            mssql_cursor.execute(f"SET IDENTITY_INSERT [{table.name}] ON")
+
+        sqlite_cursor.execute(select_sql)
+        copied = 0
+        while True:
+            rows = sqlite_cursor.fetchmany(batch_size)
+            if not rows:
+                break
+            if converters:
+                rows = [list(row) for row in rows]
+                for row in rows:
+                    for index, convert in converters:
+                        row[index] = convert(row[index])
+            mssql_cursor.executemany(insert_sql, rows)
+            mssql_conn.commit()
+            copied += len(rows)
+            print(f"  {table.name}: {copied} rows")
+
+        if identity:
+            mssql_cursor.execute(f"SET IDENTITY_INSERT [{table.name}] OFF")
+        mssql_conn.commit()
+        print(f"Copied {copied} rows to {table.name} in {timer.perf_counter() - started:.1f}s")
+        return copied
+    finally:
+        sqlite_conn.close()
+        mssql_conn.close()
+
+def stream_import_to_mssql(batch_size=DEFAULT_BATCH_SIZE, workers=DEFAULT_WORKERS):
+    """Copy every model table from SQLite to MS SQL Server, independent tables in parallel"""
+    print("Creating tables in MS SQL Server...")
+    from app import app, db
+    with app.app_context():
+        db.create_all()
+    print("Tables created successfully")
+
+    sqlite_conn = get_sqlite_connection()
+    source_tables = {row[0] for row in sqlite_conn.execute(
+        "SELECT name FROM sqlite_master WHERE type='table' AND name NOT LIKE 'sqlite_%'"
+    )}
+    sqlite_conn.close()
+
+    tables = [table for table in db.metadata.sorted_tables if table.name in source_tables]
+    skipped = source_tables - {table.name for table in tables}
+    if skipped:
+        print(f"Skipping tables without a model: {sorted(skipped)}")
+
+    total = 0
+    with ThreadPoolExecutor(max_workers=workers) as executor:
+        for wave in table_waves(tables):
+            print(f"Copying {[table.name for table in wave]}...")
+            total += sum(executor.map(lambda table: copy_table(table, batch_size), wave))
+    print(f"Successfully imported {total} records to MS SQL Server")
+    return total
+
 def update_app_config():
     """Update the Flask app configuration to use MS SQL Server"""
     print("Updating app.py configuration...")
@@ -221,6 +358,12 @@ def update_app_config():
 
 def main():
     """Main migration function"""
+    parser = argparse.ArgumentParser(description='Migrate payroll.db to MS SQL Server')
+    parser.add_argument('--batch-size', type=int, default=DEFAULT_BATCH_SIZE, help='Rows per batch')
+    parser.add_argument('--workers', type=int, default=DEFAULT_WORKERS, help='Tables copied in parallel')
+    parser.add_argument('--legacy', action='store_true', help='Use the JSON export and row-by-row import')
+    args = parser.parse_args()
+
     print("=== PAYROLL SYSTEM MS SQL MIGRATION ===")
     print("This script will migrate your data from SQLite to MS SQL Server")
     print()
@@ -234,11 +377,15 @@ def main():
         # Step 1: Create MS SQL database
         create_mssql_database()
 
-        # Step 2: Export data from SQLite
-        data = export_sqlite_data()
+        if args.legacy:
+            # Step 2: Export data from SQLite
+            data = export_sqlite_data()
 
-        # Step 3: Import data to MS SQL
-        import_to_mssql(data)
+            # Step 3: Import data to MS SQL
+            import_to_mssql(data)
+        else:
+            # Steps 2-3: Stream each table straight into MS SQL
+            stream_import_to_mssql(args.batch_size, args.workers)
 
         # Step 4: Update app configuration
         update_app_config()
@@ -248,7 +395,8 @@ def main():
         print("1. Update the MSSQL_CONFIG in this script with your actual server details")
         print("2. Test the application: python app.py")
         print("3. If everything works, you can delete the old 'payroll.db' file")
-        print("4. A backup of your SQLite data is saved in 'sqlite_backup.json'")
+        if args.legacy:
+            print("4. A backup of your SQLite data is saved in 'sqlite_backup.json'")
 
     except Exception as e:
         print(f"\n❌ MIGRATION FAILED: {e}")
@@ -1,20 +1,44 @@
-from flask_sqlalchemy import SQLAlchemy
 from werkzeug.security import generate_password_hash, check_password_hash
 from datetime import datetime, date
 import calendar
+import numpy as np
 
-db = SQLAlchemy()
+from role_cache import role_cache
+import audit
+from replica import RoutingSQLAlchemy
+
+db = RoutingSQLAlchemy()
+
+def _round_cents(values):
+    """Round an array to 2 decimals exactly like the builtin round(value, 2)"""
+    rounded = np.round(values, 2)
+    # np.round scales by 100 first, which can disagree with round() on values
+    # sitting right at a half cent; fall back to round() for just those
+    scaled = values * 100
+    ambiguous = np.flatnonzero(np.abs(scaled - np.floor(scaled) - 0.5) < 1e-6)
+    for i in ambiguous:
+        rounded.flat[i] = round(float(values.flat[i]), 2)
+    return rounded
 
 # CRUD Operations Classes
 class CRUDMixin:
     """Mixin class providing basic CRUD operations"""
 
+    # Set to False on models whose writes must not be audited
+    __audited__ = True
+
     @classmethod
     def create(cls, **kwargs):
         """Create a new record"""
         instance = cls(**kwargs)
         db.session.add(instance)
+        if cls.__audited__:
+            # Capture audit values once the flush assigns the id; commit expires them
+            db.session.flush()
+            record_id, new_values = instance.id, audit.model_values(instance)
         db.session.commit()
+        if cls.__audited__:
+            audit.record('create', cls.__tablename__, record_id, new_values=new_values)
         return instance
 
     @classmethod
@@ -34,21 +58,54 @@ class CRUDMixin:
 
     def update(self, **kwargs):
         """Update record with given values"""
-        for key, value in kwargs.items():
-            if hasattr(self, key):
-                setattr(self, key, value)
+        keys = [key for key in kwargs if hasattr(self, key)]
+        old_values = {key: getattr(self, key) for key in keys}
+        for key in keys:
+            setattr(self, key, kwargs[key])
+        changed = []
+        if self.__audited__:
+            db.session.flush()
+            changed = [key for key in keys if key in self.__table__.columns and old_values[key] != getattr(self, key)]
+            record_id, new_values = self.id, audit.model_values(self, changed)
         db.session.commit()
+        if changed:
+            audit.record('update', self.__tablename__, record_id,
+                         old_values=audit.redact({key: old_values[key] for key in changed}),
+                         new_values=new_values)
         return self
 
     def delete(self):
         """Delete the record"""
+        old_values = audit.model_values(self) if self.__audited__ else None
+        record_id = self.id
         db.session.delete(self)
         db.session.commit()
+        if self.__audited__:
+            audit.record('delete', self.__tablename__, record_id, old_values=old_values)
 
     def save(self):
         """Save the record"""
+        state = db.inspect(self)
+        is_new = state.transient or state.pending
+        old_values = {}
+        if self.__audited__ and not is_new:
+            for attr in state.mapper.column_attrs:
+                history = state.attrs[attr.key].history
+                if history.has_changes():
+                    old_values[attr.key] = history.deleted[0] if history.deleted else None
         db.session.add(self)
+        if self.__audited__:
+            db.session.flush()
+            record_id = self.id
+            new_values = audit.model_values(self, None if is_new else old_values)
         db.session.commit()
+        if self.__audited__:
+            if is_new:
+                audit.record('create', self.__tablename__, record_id, new_values=new_values)
+            elif old_values:
+                audit.record('update', self.__tablename__, record_id,
+                             old_values=audit.redact(old_values),
+                             new_values=new_values)
         return self
 
 # Association table for many-to-many relationship between users and departments
@@ -73,6 +130,35 @@ class Department(db.Model, CRUDMixin):
     def __repr__(self):
         return f'<Department {self.name}>'
 
+class Holiday(db.Model, CRUDMixin):
+    """Non-working day for one department, or for everyone when department_id is NULL"""
+    __tablename__ = 'holiday'
+
+    id = db.Column(db.Integer, primary_key=True)
+    date = db.Column(db.Date, nullable=False, index=True)
+    name = db.Column(db.String(100), nullable=False)
+    department_id = db.Column(db.Integer, db.ForeignKey('department.id'), nullable=True)
+    created_at = db.Column(db.DateTime, default=datetime.utcnow)
+
+    __table_args__ = (db.UniqueConstraint('date', 'department_id', name='unique_department_holiday'),)
+
+    def __repr__(self):
+        return f'<Holiday {self.date} {self.name}>'
+
+class WeeklyOffRule(db.Model, CRUDMixin):
+    """Weekday (0 = Monday) off for one department, or the company default when department_id is NULL"""
+    __tablename__ = 'weekly_off_rule'
+
+    id = db.Column(db.Integer, primary_key=True)
+    department_id = db.Column(db.Integer, db.ForeignKey('department.id'), nullable=True)
+    weekday = db.Column(db.Integer, nullable=False)
+    created_at = db.Column(db.DateTime, default=datetime.utcnow)
+
+    __table_args__ = (db.UniqueConstraint('department_id', 'weekday', name='unique_department_weekday'),)
+
+    def __repr__(self):
+        return f'<WeeklyOffRule department_id={self.department_id} weekday={self.weekday}>'
+
 class User(db.Model, CRUDMixin):
     """User model for authentication and basic user information"""
     __tablename__ = 'user'
@@ -98,6 +184,7 @@ class User(db.Model, CRUDMixin):
     payroll_records = db.relationship('MonthlyPayout', backref='user', lazy=True, foreign_keys='MonthlyPayout.user_id')
     leaves = db.relationship('Leave', backref='user', lazy=True, foreign_keys='Leave.user_id')
     advances = db.relationship('Advance', lazy=True, foreign_keys='Advance.user_id')
+    employee_details = db.relationship('EmployeeDetails', backref='user', lazy=True, uselist=False)
 
     def set_password(self, password):
         self.password_hash = generate_password_hash(password)
@@ -111,6 +198,21 @@ class User(db.Model, CRUDMixin):
     def is_manager(self):
         return self.role in ['admin', 'manager']
 
+    def update(self, **kwargs):
+        """Update the user and drop any cached role"""
+        user = super().update(**kwargs)
+        # Only after the commit: a request reading the old row in between
+        # would otherwise cache the old role again for the whole TTL
+        role_cache.invalidate(self.id)
+        return user
+
+    def delete(self):
+        """Delete the user and drop any cached role"""
+        user_id = self.id
+        result = super().delete()
+        role_cache.invalidate(user_id)
+        return result
+
     def __repr__(self):
         return f'<User {self.username} ({self.role})>'
 
@@ -129,8 +231,17 @@ class EmployeeDetails(db.Model, CRUDMixin):
     created_at = db.Column(db.DateTime, default=datetime.utcnow)
     updated_at = db.Column(db.DateTime, default=datetime.utcnow, onupdate=datetime.utcnow)
 
-    def calculate_monthly_salary(self, days_present, total_days, hours_worked=0):
-        """Calculate salary for the month"""
+    def calculate_monthly_salary(self, days_present, total_days=None, hours_worked=0, pay_period=None):
+        """Calculate salary for the month.
+
+        Without total_days, salaried pay is prorated over the working days of
+        pay_period, a (start, end) pair, in the employee's department calendar.
+        """
+        if total_days is None:
+            from work_calendar import work_calendar
+            department = self.user.departments.order_by(Department.id).first()
+            total_days = work_calendar.working_days(*pay_period, department.id if department else None)
+
         if self.is_hourly:
             regular_pay = hours_worked * self.hourly_rate
             # Assume 8 hours/day for overtime calculation
@@ -148,6 +259,40 @@ class EmployeeDetails(db.Model, CRUDMixin):
             'net_salary': round(gross_salary, 2)
         }
 
+    @staticmethod
+    def calculate_monthly_salaries(basic_salary, is_hourly, hourly_rate, overtime_rate,
+                                   days_present, hours_worked, total_days):
+        """Batch version of calculate_monthly_salary over column arrays.
+
+        Returns (gross_salary, net_salary) float64 arrays that match the scalar
+        method element for element, including its rounding.
+        """
+        basic_salary = np.asarray(basic_salary, dtype=np.float64)
+        is_hourly = np.asarray(is_hourly, dtype=bool)
+        hourly_rate = np.asarray(hourly_rate, dtype=np.float64)
+        overtime_rate = np.asarray(overtime_rate, dtype=np.float64)
+        days_present = np.asarray(days_present, dtype=np.float64)
+        hours_worked = np.asarray(hours_worked, dtype=np.float64)
+        total_days = np.broadcast_to(np.asarray(total_days, dtype=np.float64), basic_salary.shape)
+
+        if np.any(~is_hourly & (total_days == 0)):
+            raise ZeroDivisionError('total_days must be non-zero for salaried employees')
+        # None becomes NaN above; the scalar method raises TypeError on it instead
+        if np.any(is_hourly & (np.isnan(hourly_rate) | np.isnan(overtime_rate))):
+            raise TypeError('hourly_rate and overtime_rate are required for hourly employees')
+
+        with np.errstate(divide='ignore', invalid='ignore'):
+            # Same operation order as the scalar method so results are bit-identical
+            regular_pay = hours_worked * hourly_rate
+            standard_hours = days_present * 8
+            overtime_hours = np.maximum(0.0, hours_worked - standard_hours)
+            overtime_pay = overtime_hours * overtime_rate
+            hourly_gross = regular_pay + overtime_pay
+            salaried_gross = basic_salary * (days_present / total_days)
+
+        gross_salary = _round_cents(np.where(is_hourly, hourly_gross, salaried_gross))
+        return gross_salary, gross_salary.copy()
+
     def __repr__(self):
         return f'<EmployeeDetails user_id={self.user_id} salary={self.basic_salary}>'
 
@@ -174,6 +319,42 @@ class Attendance(db.Model, CRUDMixin):
     def __repr__(self):
         return f'<Attendance user_id={self.user_id} date={self.date} present={self.present}>'
 
+class AttendanceMonthly(db.Model, CRUDMixin):
+    """Per-user monthly attendance rollup, kept in sync with Attendance by attendance_rollup"""
+    __tablename__ = 'attendance_monthly'
+    __audited__ = False
+
+    id = db.Column(db.Integer, primary_key=True)
+    user_id = db.Column(db.Integer, db.ForeignKey('user.id'), nullable=False)
+    year = db.Column(db.Integer, nullable=False)
+    month = db.Column(db.Integer, nullable=False)
+    days_present = db.Column(db.Integer, default=0)
+    hours_worked = db.Column(db.Float, default=0.0)
+    pending_count = db.Column(db.Integer, default=0)
+    approved_count = db.Column(db.Integer, default=0)
+    present_mask = db.Column(db.Integer, nullable=False, default=0)  # Bit day-1 set when present that day
+
+    __table_args__ = (
+        db.UniqueConstraint('user_id', 'year', 'month', name='unique_user_month'),
+        db.Index('ix_attendance_monthly_period', 'year', 'month'),
+    )
+
+    def __repr__(self):
+        return f'<AttendanceMonthly user_id={self.user_id} {self.year}-{self.month:02d} present={self.days_present}>'
+
+class RollupState(db.Model, CRUDMixin):
+    """Records which version of a rollup table was last built in full, see attendance_rollup"""
+    __tablename__ = 'rollup_state'
+    __audited__ = False
+
+    id = db.Column(db.Integer, primary_key=True)
+    name = db.Column(db.String(50), nullable=False, unique=True)  # Rollup table name
+    version = db.Column(db.Integer, nullable=False)
+    built_at = db.Column(db.DateTime, default=datetime.utcnow)
+
+    def __repr__(self):
+        return f'<RollupState {self.name} v{self.version}>'
+
 class Leave(db.Model, CRUDMixin):
     """Leave requests and records"""
     __tablename__ = 'leave'
@@ -219,9 +400,45 @@ class MonthlyPayout(db.Model, CRUDMixin):
     def __repr__(self):
         return f'<MonthlyPayout user_id={self.user_id} {self.pay_period_start}-{self.pay_period_end} net={self.net_salary}>'
 
+class PayrollJob(db.Model, CRUDMixin):
+    """Queued background payroll generation runs"""
+    __tablename__ = 'payroll_job'
+
+    id = db.Column(db.Integer, primary_key=True)
+    pay_period_start = db.Column(db.Date, nullable=False)
+    pay_period_end = db.Column(db.Date, nullable=False)
+    status = db.Column(db.String(20), default='queued', index=True)  # 'queued', 'running', 'completed', 'failed'
+    progress = db.Column(db.Integer, default=0)  # Percent complete, 0-100
+    parallel = db.Column(db.Boolean, default=False)  # Compute department partitions in a process pool
+    payouts_created = db.Column(db.Integer, default=0)
+    error = db.Column(db.Text, nullable=True)
+    requested_by = db.Column(db.Integer, db.ForeignKey('user.id'), nullable=True)
+    worker_id = db.Column(db.String(100), nullable=True)  # host:pid of the worker running the job
+    heartbeat_at = db.Column(db.DateTime, nullable=True)  # Refreshed by that worker while it runs the job
+    started_at = db.Column(db.DateTime, nullable=True)
+    finished_at = db.Column(db.DateTime, nullable=True)
+    created_at = db.Column(db.DateTime, default=datetime.utcnow)
+    updated_at = db.Column(db.DateTime, default=datetime.utcnow, onupdate=datetime.utcnow)
+
+    def to_dict(self):
+        return {
+            'id': self.id,
+            'pay_period_start': self.pay_period_start.isoformat(),
+            'pay_period_end': self.pay_period_end.isoformat(),
+            'status': self.status,
+            'progress': self.progress,
+            'parallel': self.parallel,
+            'payouts_created': self.payouts_created,
+            'error': self.error
+        }
+
+    def __repr__(self):
+        return f'<PayrollJob {self.id} {self.pay_period_start}-{self.pay_period_end} {self.status}>'
+
 class AuditLog(db.Model, CRUDMixin):
     """Audit log for tracking changes"""
     __tablename__ = 'audit_log'
+    __audited__ = False
 
     id = db.Column(db.Integer, primary_key=True)
     user_id = db.Column(db.Integer, db.ForeignKey('user.id'), nullable=True)  # Who made the change
@@ -239,6 +456,24 @@ class AuditLog(db.Model, CRUDMixin):
     def __repr__(self):
         return f'<AuditLog {self.action} {self.table_name}:{self.record_id}>'
 
+class ArchivePartition(db.Model, CRUDMixin):
+    """One year's archive table for attendance or audit_log, maintained by archive"""
+    __tablename__ = 'archive_partition'
+    __audited__ = False
+
+    id = db.Column(db.Integer, primary_key=True)
+    source_table = db.Column(db.String(50), nullable=False)  # 'attendance', 'audit_log'
+    year = db.Column(db.Integer, nullable=False)
+    archive_table = db.Column(db.String(100), nullable=False)
+    row_count = db.Column(db.Integer, default=0)
+    archived_before = db.Column(db.Date, nullable=False)  # Rows before this date may be archived
+    updated_at = db.Column(db.DateTime, default=datetime.utcnow, onupdate=datetime.utcnow)
+
+    __table_args__ = (db.UniqueConstraint('source_table', 'year', name='unique_archive_partition'),)
+
+    def __repr__(self):
+        return f'<ArchivePartition {self.archive_table} rows={self.row_count}>'
+
 class Advance(db.Model, CRUDMixin):
     """Employee advances tracking"""
     __tablename__ = 'advance'
@@ -255,6 +490,8 @@ class Advance(db.Model, CRUDMixin):
     updated_at = db.Column(db.DateTime, default=datetime.utcnow, onupdate=datetime.utcnow)
 
     user = db.relationship('User', overlaps="advances")
+    deductions = db.relationship('AdvanceDeduction', backref='advance', lazy=True, cascade='all, delete-orphan',
+                                 order_by='AdvanceDeduction.pay_period_start')
 
     def apply_monthly_deduction(self):
         """Apply monthly deduction"""
@@ -270,6 +507,28 @@ class Advance(db.Model, CRUDMixin):
     def __repr__(self):
         return f'<Advance user_id={self.user_id} amount={self.amount} remaining={self.remaining_balance}>'
 
+class AdvanceDeduction(db.Model, CRUDMixin):
+    """One payroll run's deduction from an advance, written by advance_ledger"""
+    __tablename__ = 'advance_deduction'
+    __audited__ = False
+
+    id = db.Column(db.Integer, primary_key=True)
+    advance_id = db.Column(db.Integer, db.ForeignKey('advance.id'), nullable=False)
+    user_id = db.Column(db.Integer, db.ForeignKey('user.id'), nullable=False)
+    pay_period_start = db.Column(db.Date, nullable=False)
+    pay_period_end = db.Column(db.Date, nullable=False)
+    amount = db.Column(db.Float, nullable=False)
+    balance_after = db.Column(db.Float, nullable=False)
+    created_at = db.Column(db.DateTime, default=datetime.utcnow)
+
+    __table_args__ = (
+        db.UniqueConstraint('advance_id', 'pay_period_start', 'pay_period_end', name='unique_advance_pay_period'),
+        db.Index('ix_advance_deduction_period', 'pay_period_start', 'pay_period_end'),
+    )
+
+    def __repr__(self):
+        return f'<AdvanceDeduction advance_id={self.advance_id} {self.pay_period_start}-{self.pay_period_end} amount={self.amount}>'
+
 # CRUD Operations Classes
 class CRUDMixin:
     """Mixin class providing basic CRUD operations"""
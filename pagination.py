@@ -0,0 +1,130 @@
+"""
+Keyset (cursor) pagination for admin list pages
+Pages are addressed by the sort key of their first or last row instead of
+an OFFSET, so every page costs the same however much history builds up and
+links stay stable while new rows are added.
+"""
+
+import base64
+import json
+from datetime import date, datetime
+
+from sqlalchemy import and_, or_
+
+DEFAULT_PAGE_SIZE = 50
+MAX_PAGE_SIZE = 200
+
+
+class InvalidCursor(ValueError):
+    """Raised when a cursor token cannot be decoded"""
+
+
+class KeysetPage:
+    """One page of results plus the cursors for its neighbours"""
+
+    def __init__(self, items, next_cursor=None, prev_cursor=None):
+        self.items = items
+        self.next_cursor = next_cursor
+        self.prev_cursor = prev_cursor
+
+    @property
+    def has_next(self):
+        return self.next_cursor is not None
+
+    @property
+    def has_prev(self):
+        return self.prev_cursor is not None
+
+    def __iter__(self):
+        return iter(self.items)
+
+    def __len__(self):
+        return len(self.items)
+
+
+def _to_json(value):
+    if isinstance(value, datetime):
+        return {'dt': value.isoformat()}
+    if isinstance(value, date):
+        return {'d': value.isoformat()}
+    return value
+
+
+def _from_json(value):
+    if isinstance(value, dict):
+        if 'dt' in value:
+            return datetime.fromisoformat(value['dt'])
+        if 'd' in value:
+            return date.fromisoformat(value['d'])
+    return value
+
+
+def encode_cursor(sort_value, row_id):
+    payload = json.dumps([_to_json(sort_value), row_id], separators=(',', ':'))
+    return base64.urlsafe_b64encode(payload.encode()).decode().rstrip('=')
+
+
+def decode_cursor(token):
+    try:
+        padded = token + '=' * (-len(token) % 4)
+        sort_value, row_id = json.loads(base64.urlsafe_b64decode(padded.encode()))
+        return _from_json(sort_value), int(row_id)
+    except (ValueError, TypeError) as e:
+        raise InvalidCursor(f'Invalid page cursor: {token}') from e
+
+
+def page_size(value):
+    """Clamp a requested page size to a sane range"""
+    try:
+        value = int(value)
+    except (TypeError, ValueError):
+        return DEFAULT_PAGE_SIZE
+    return max(1, min(value, MAX_PAGE_SIZE))
+
+
+def keyset_paginate(query, sort_column, id_column, after=None, before=None,
+                    per_page=DEFAULT_PAGE_SIZE, descending=True):
+    """Return a KeysetPage ordered by (sort_column, id_column).
+
+    after/before are cursor tokens from a previous page's next_cursor and
+    prev_cursor. id_column breaks ties so the order is total.
+    """
+    sort_key = lambda row: (getattr(row, sort_column.key), getattr(row, id_column.key))
+
+    def beyond(cursor, forward):
+        sort_value, row_id = decode_cursor(cursor)
+        # Moving forward through a descending list means smaller keys
+        smaller = forward == descending
+        if smaller:
+            return or_(sort_column < sort_value, and_(sort_column == sort_value, id_column < row_id))
+        return or_(sort_column > sort_value, and_(sort_column == sort_value, id_column > row_id))
+
+    backwards = before is not None and after is None
+    if after is not None:
+        query = query.filter(beyond(after, forward=True))
+    elif backwards:
+        query = query.filter(beyond(before, forward=False))
+
+    # Walking backwards reverses the order; rows are flipped back below
+    if descending != backwards:
+        query = query.order_by(sort_column.desc(), id_column.desc())
+    else:
+        query = query.order_by(sort_column.asc(), id_column.asc())
+
+    rows = query.limit(per_page + 1).all()
+    has_more = len(rows) > per_page
+    rows = rows[:per_page]
+    if backwards:
+        rows.reverse()
+
+    if not rows:
+        return KeysetPage([])
+
+    first, last = sort_key(rows[0]), sort_key(rows[-1])
+    if backwards:
+        next_cursor = encode_cursor(*last)
+        prev_cursor = encode_cursor(*first) if has_more else None
+    else:
+        next_cursor = encode_cursor(*last) if has_more else None
+        prev_cursor = encode_cursor(*first) if after is not None else None
+    return KeysetPage(rows, next_cursor=next_cursor, prev_cursor=prev_cursor)
@@ -1,11 +1,12 @@
 import os
-from database_config import get_database_uri
+from database_config import get_database_uri, get_engine_options
 
 class Config:
     """Base configuration"""
     SECRET_KEY = os.environ.get('SECRET_KEY') or 'dev-secret-key-change-in-production'
     SQLALCHEMY_DATABASE_URI = get_database_uri()
     SQLALCHEMY_TRACK_MODIFICATIONS = False
+    SQLALCHEMY_ENGINE_OPTIONS = get_engine_options()
     WTF_CSRF_ENABLED = True
 
 class DevelopmentConfig(Config):
@@ -18,6 +19,8 @@ class ProductionConfig(Config):
     DEBUG = False
     TESTING = False
     SQLALCHEMY_ECHO = False
+    # Each gunicorn worker keeps its own pool: 4 workers x (10 + 20) connections at most
+    SQLALCHEMY_ENGINE_OPTIONS = get_engine_options(pool_size=10, max_overflow=20)
 
     # Security settings
     SESSION_COOKIE_SECURE = True
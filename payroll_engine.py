@@ -0,0 +1,322 @@
+"""
+Set-based payroll generation engine
+Loads attendance totals and active advances with one query each, computes
+pay in memory and writes every payout, advance balance and deduction ledger
+row in a single transaction.
+
+In parallel mode employees are partitioned by department (or by id range
+when they have none) and each partition is priced in a process pool. The
+computation only sees plain tuples and dicts, so serial and parallel runs
+produce identical rows.
+"""
+
+import os
+from collections import namedtuple
+from concurrent.futures import ProcessPoolExecutor
+
+from sqlalchemy import func, case
+
+from models import db, User, EmployeeDetails, MonthlyPayout, Advance, user_departments
+import advance_ledger
+import archive
+import attendance_bitsets
+import attendance_rollup
+import audit
+from leave_index import LeaveIndex
+from work_calendar import work_calendar
+
+# Partition size for employees that are not assigned to any department
+ID_RANGE_PARTITION_SIZE = 500
+
+EmployeeRow = namedtuple('EmployeeRow', 'user_id basic_salary is_hourly hourly_rate overtime_rate')
+
+
+class PayrollAlreadyGenerated(Exception):
+    """Raised when payouts already exist for the requested pay period"""
+
+
+class NoWorkingDays(Exception):
+    """Raised when a pay period has no working days to prorate salaries over"""
+
+
+def load_employees():
+    """Load every employee's salary details in one query"""
+    rows = (
+        db.session.query(
+            User.id,
+            EmployeeDetails.basic_salary,
+            EmployeeDetails.is_hourly,
+            EmployeeDetails.hourly_rate,
+            EmployeeDetails.overtime_rate
+        )
+        .join(EmployeeDetails, EmployeeDetails.user_id == User.id)
+        .filter(User.role == 'employee')
+        .order_by(User.id)
+        .all()
+    )
+    return [EmployeeRow(*row) for row in rows]
+
+
+def load_attendance_totals(pay_period_start, pay_period_end):
+    """Return {user_id: (days_present, hours_worked)} from one grouped aggregate.
+
+    Periods made of whole calendar months are read from the monthly rollup.
+    """
+    months = attendance_rollup.whole_months(pay_period_start, pay_period_end)
+    if months:
+        return attendance_rollup.load_month_totals(months)
+
+    attendance = archive.source('attendance', pay_period_start, pay_period_end)
+    rows = (
+        db.session.query(
+            attendance.c.user_id,
+            func.sum(case((attendance.c.present == True, 1), else_=0)),
+            func.coalesce(func.sum(attendance.c.hours_worked), 0.0)
+        )
+        .group_by(attendance.c.user_id)
+        .all()
+    )
+    return {user_id: (int(days or 0), float(hours or 0.0)) for user_id, days, hours in rows}
+
+
+def load_department_assignments():
+    """Return {user_id: department_id} using each user's lowest department id"""
+    rows = (
+        db.session.query(user_departments.c.user_id, func.min(user_departments.c.department_id))
+        .group_by(user_departments.c.user_id)
+        .all()
+    )
+    return dict(rows)
+
+
+def partition_employees(employees, departments, range_size=ID_RANGE_PARTITION_SIZE):
+    """Split employees by department, falling back to id ranges for unassigned ones"""
+    partitions = {}
+    for employee in employees:
+        department_id = departments.get(employee.user_id)
+        if department_id is not None:
+            key = ('department', department_id)
+        else:
+            key = ('id_range', employee.user_id // range_size)
+        partitions.setdefault(key, []).append(employee)
+    return [partitions[key] for key in sorted(partitions)]
+
+
+def load_working_days(employees, departments, pay_period_start, pay_period_end):
+    """Return {user_id: working days in the period} from each employee's department calendar"""
+    by_department = {}
+    working_days = {}
+    for employee in employees:
+        department_id = departments.get(employee.user_id)
+        if department_id not in by_department:
+            by_department[department_id] = work_calendar.working_days(pay_period_start, pay_period_end, department_id)
+        working_days[employee.user_id] = by_department[department_id]
+    return working_days
+
+
+def load_paid_days(employees, departments, attendance_totals, working_days, pay_period_start, pay_period_end):
+    """Return {user_id: days paid} for salaried employees.
+
+    Only attendance on the department's working days counts, topped up with
+    approved paid leave on the working days the employee did not attend, so
+    the result never exceeds the period's working days. Raises RollupNotBuilt
+    when the present_mask bitmaps disagree with attendance_totals rather than
+    pay from stale masks.
+    """
+    index = LeaveIndex.load(pay_period_start, pay_period_end)
+    present = attendance_bitsets.period_bitmaps(pay_period_start, pay_period_end)
+    working = {}
+    paid_days = {}
+    for employee in employees:
+        if employee.is_hourly:
+            continue
+        days_present = attendance_totals.get(employee.user_id, (0, 0.0))[0]
+        if present.get(employee.user_id, 0).bit_count() != days_present:
+            raise attendance_rollup.RollupNotBuilt(
+                f'present_mask for employee {employee.user_id} does not match {days_present} days present; '
+                'run "flask rebuild-attendance-rollup" first'
+            )
+        department_id = departments.get(employee.user_id)
+        if department_id not in working:
+            working[department_id] = work_calendar.day_bitmap(pay_period_start, pay_period_end, department_id)
+        present_working = present.get(employee.user_id, 0) & working[department_id]
+        leave_days = index.paid_leave_days(
+            employee.user_id, pay_period_start, pay_period_end, working[department_id], present_working
+        )
+        paid_days[employee.user_id] = min(present_working.bit_count() + leave_days, working_days[employee.user_id])
+    return paid_days
+
+
+def compute_payroll(employees, attendance_totals, advances_by_user, working_days, paid_days,
+                    pay_period_start, pay_period_end):
+    """Compute payout rows, advance updates and ledger entries for the pay period in memory"""
+    days_present = []
+    days_paid = []
+    hours_worked = []
+    total_days = []
+    for employee in employees:
+        days, hours = attendance_totals.get(employee.user_id, (0, 0.0))
+        days_present.append(days)
+        hours_worked.append(hours)
+        total_days.append(working_days[employee.user_id])
+        # Hourly pay follows hours; days only set the overtime threshold
+        days_paid.append(days if employee.is_hourly else paid_days.get(employee.user_id, 0))
+
+    gross_salaries, _ = EmployeeDetails.calculate_monthly_salaries(
+        basic_salary=[employee.basic_salary for employee in employees],
+        is_hourly=[employee.is_hourly for employee in employees],
+        hourly_rate=[employee.hourly_rate for employee in employees],
+        overtime_rate=[employee.overtime_rate for employee in employees],
+        days_present=days_paid,
+        hours_worked=hours_worked,
+        total_days=total_days
+    )
+
+    payouts = []
+    advance_updates = []
+    ledger_entries = []
+    for employee, days, gross_salary in zip(employees, days_present, gross_salaries.tolist()):
+        advance_deductions, updates, entries = advance_ledger.compute_deductions(
+            advances_by_user.get(employee.user_id, []), pay_period_start, pay_period_end
+        )
+        advance_updates.extend(updates)
+        ledger_entries.extend(entries)
+
+        payouts.append({
+            'user_id': employee.user_id,
+            'pay_period_start': pay_period_start,
+            'pay_period_end': pay_period_end,
+            'days_worked': days,
+            'gross_earnings': gross_salary,
+            'advance_deduction': advance_deductions,
+            'final_payout': round(gross_salary - advance_deductions, 2),
+            'status': 'calculated'
+        })
+
+    return payouts, advance_updates, ledger_entries
+
+
+def _compute_partition(args):
+    """Process pool entry point; receives only the data for one partition"""
+    return compute_payroll(*args)
+
+
+def compute_payroll_parallel(employees, attendance_totals, advances_by_user, working_days, paid_days, departments,
+                             pay_period_start, pay_period_end, max_workers=None):
+    """Compute each department partition in a process pool and merge the results"""
+    partitions = partition_employees(employees, departments)
+
+    tasks = []
+    for partition in partitions:
+        user_ids = [employee.user_id for employee in partition]
+        tasks.append((
+            partition,
+            {user_id: attendance_totals[user_id] for user_id in user_ids if user_id in attendance_totals},
+            {user_id: advances_by_user[user_id] for user_id in user_ids if user_id in advances_by_user},
+            {user_id: working_days[user_id] for user_id in user_ids},
+            {user_id: paid_days[user_id] for user_id in user_ids if user_id in paid_days},
+            pay_period_start,
+            pay_period_end
+        ))
+
+    payouts = []
+    advance_updates = []
+    ledger_entries = []
+    if tasks:
+        with ProcessPoolExecutor(max_workers=max_workers or os.cpu_count()) as executor:
+            for partition_payouts, partition_updates, partition_entries in executor.map(_compute_partition, tasks):
+                payouts.extend(partition_payouts)
+                advance_updates.extend(partition_updates)
+                ledger_entries.extend(partition_entries)
+
+    # Restore serial ordering so both modes insert identical rows
+    payouts.sort(key=lambda payout: payout['user_id'])
+    advance_updates.sort(key=lambda update: update['id'])
+    ledger_entries.sort(key=lambda entry: entry['advance_id'])
+    return payouts, advance_updates, ledger_entries
+
+
+def payroll_exists(pay_period_start, pay_period_end):
+    """Check whether payouts were already generated for the pay period"""
+    return MonthlyPayout.query.filter_by(
+        pay_period_start=pay_period_start,
+        pay_period_end=pay_period_end
+    ).first() is not None
+
+
+def generate_payroll(pay_period_start, pay_period_end, progress=None, parallel=False, max_workers=None):
+    """Generate payouts for every employee in one transaction, returning the row count.
+
+    progress, if given, is called with a percent complete as each stage finishes.
+    parallel computes department partitions in a pool of max_workers processes.
+    """
+    report = progress or (lambda percent: None)
+
+    if payroll_exists(pay_period_start, pay_period_end):
+        raise PayrollAlreadyGenerated(f'Payroll already generated for {pay_period_start} - {pay_period_end}')
+
+    attendance_rollup.ensure_built()
+    employees = load_employees()
+    report(10)
+    attendance_totals = load_attendance_totals(pay_period_start, pay_period_end)
+    report(30)
+    advances_by_user = advance_ledger.load_active_advances(pay_period_end)
+    departments = load_department_assignments()
+    working_days = load_working_days(employees, departments, pay_period_start, pay_period_end)
+    if any(days == 0 for days in working_days.values()):
+        raise NoWorkingDays(f'{pay_period_start} - {pay_period_end} has no working days in the work calendar')
+    paid_days = load_paid_days(employees, departments, attendance_totals, working_days,
+                               pay_period_start, pay_period_end)
+    report(40)
+
+    if parallel:
+        payouts, advance_updates, ledger_entries = compute_payroll_parallel(
+            employees, attendance_totals, advances_by_user, working_days, paid_days, departments,
+            pay_period_start, pay_period_end, max_workers=max_workers
+        )
+    else:
+        payouts, advance_updates, ledger_entries = compute_payroll(
+            employees, attendance_totals, advances_by_user, working_days, paid_days,
+            pay_period_start, pay_period_end
+        )
+    report(70)
+
+    try:
+        db.session.bulk_insert_mappings(MonthlyPayout, payouts)
+        advance_ledger.write_deductions(advance_updates, ledger_entries)
+        db.session.commit()
+    except Exception:
+        db.session.rollback()
+        raise
+
+    _audit_payroll(pay_period_start, pay_period_end, payouts, advance_updates, advances_by_user)
+    report(100)
+    return len(payouts)
+
+
+def _audit_payroll(pay_period_start, pay_period_end, payouts, advance_updates, advances_by_user):
+    """Queue audit records for the rows written by generate_payroll"""
+    if not audit.writer.enabled:
+        return
+
+    # bulk_insert_mappings does not return keys; one query maps users to new payout ids
+    payout_ids = dict(
+        db.session.query(MonthlyPayout.user_id, MonthlyPayout.id)
+        .filter_by(pay_period_start=pay_period_start, pay_period_end=pay_period_end)
+    )
+    audit.record_many('create', MonthlyPayout.__tablename__, [
+        (payout_ids[payout['user_id']], None, payout) for payout in payouts
+    ])
+
+    previous = {
+        advance['id']: advance
+        for advances in advances_by_user.values() for advance in advances
+    }
+    audit.record_many('update', Advance.__tablename__, [
+        (
+            update['id'],
+            {key: previous[update['id']][key] for key in ('remaining_balance', 'status')},
+            {key: update[key] for key in ('remaining_balance', 'status')}
+        )
+        for update in advance_updates
+    ])
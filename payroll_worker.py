@@ -0,0 +1,159 @@
+#!/usr/bin/env python3
+"""
+Background worker for queued payroll generation jobs
+Polls the payroll_job table and runs each job outside the web request.
+Several workers may share a database: claiming is atomic, and a running
+job carries its worker's id and a heartbeat. On startup a worker only
+fails running jobs whose heartbeat has gone stale.
+
+Usage: python payroll_worker.py [--once] [--poll-interval SECONDS] [--processes N]
+                                [--metrics-port PORT]
+"""
+
+import argparse
+import os
+import socket
+import threading
+import time
+import traceback
+from datetime import datetime, timedelta
+
+from prometheus_client import start_http_server
+
+from app import app
+from models import db, PayrollJob
+import payroll_engine
+from metrics import PAYROLL_JOB_DURATION
+
+# Seconds between heartbeats of a running job
+HEARTBEAT_INTERVAL = 15
+# A running job whose heartbeat is older than this lost its worker
+HEARTBEAT_TIMEOUT = 4 * HEARTBEAT_INTERVAL
+
+WORKER_ID = f'{socket.gethostname()}:{os.getpid()}'
+
+
+def claim_next_job():
+    """Atomically move the oldest queued job to running and return its id"""
+    while True:
+        job = PayrollJob.query.filter_by(status='queued').order_by(PayrollJob.id).first()
+        if job is None:
+            db.session.rollback()
+            return None
+
+        # Guard on status so two workers can never claim the same job
+        now = datetime.utcnow()
+        claimed = PayrollJob.query.filter_by(id=job.id, status='queued').update(
+            {'status': 'running', 'progress': 0, 'worker_id': WORKER_ID, 'started_at': now, 'heartbeat_at': now},
+            synchronize_session=False
+        )
+        db.session.commit()
+        if claimed:
+            return job.id
+
+
+def set_progress(job_id, percent):
+    """Record progress on its own connection so pollers see it mid-transaction"""
+    with db.engine.begin() as conn:
+        conn.execute(
+            PayrollJob.__table__.update()
+            .where(PayrollJob.__table__.c.id == job_id)
+            .values(progress=percent, updated_at=datetime.utcnow())
+        )
+
+
+def _send_heartbeats(engine, job_id, stopped):
+    """Refresh the job's heartbeat on its own connection until stopped is set"""
+    while not stopped.wait(HEARTBEAT_INTERVAL):
+        try:
+            with engine.begin() as conn:
+                conn.execute(
+                    PayrollJob.__table__.update()
+                    .where(PayrollJob.__table__.c.id == job_id)
+                    .values(heartbeat_at=datetime.utcnow())
+                )
+        except Exception:
+            traceback.print_exc()
+
+
+def run_job(job_id, processes=None):
+    """Run one claimed job and record its outcome"""
+    job = PayrollJob.query.get(job_id)
+    print(f"Running payroll job {job_id} for {job.pay_period_start} - {job.pay_period_end}")
+    started = time.perf_counter()
+
+    stopped = threading.Event()
+    heartbeat = threading.Thread(target=_send_heartbeats, args=(db.engine, job_id, stopped), daemon=True)
+    heartbeat.start()
+    try:
+        try:
+            created = payroll_engine.generate_payroll(
+                job.pay_period_start,
+                job.pay_period_end,
+                progress=lambda percent: set_progress(job_id, percent),
+                parallel=job.parallel,
+                max_workers=processes
+            )
+        finally:
+            stopped.set()
+            heartbeat.join()
+    except Exception as e:
+        db.session.rollback()
+        traceback.print_exc()
+        PAYROLL_JOB_DURATION.labels('failed').observe(time.perf_counter() - started)
+        job = PayrollJob.query.get(job_id)
+        job.update(status='failed', error=str(e), finished_at=datetime.utcnow())
+        return
+
+    PAYROLL_JOB_DURATION.labels('completed').observe(time.perf_counter() - started)
+    job = PayrollJob.query.get(job_id)
+    job.update(status='completed', progress=100, payouts_created=created, finished_at=datetime.utcnow())
+    print(f"Payroll job {job_id} completed: {created} payouts")
+
+
+def fail_interrupted_jobs():
+    """Mark jobs whose worker stopped sending heartbeats as failed so they can be resubmitted.
+
+    Jobs another live worker is running keep a fresh heartbeat and are left alone.
+    """
+    stale_before = datetime.utcnow() - timedelta(seconds=HEARTBEAT_TIMEOUT)
+    PayrollJob.query.filter(
+        PayrollJob.status == 'running',
+        db.or_(PayrollJob.heartbeat_at.is_(None), PayrollJob.heartbeat_at < stale_before)
+    ).update(
+        {'status': 'failed', 'error': 'Worker stopped before the job finished', 'finished_at': datetime.utcnow()},
+        synchronize_session=False
+    )
+    db.session.commit()
+
+
+def main():
+    parser = argparse.ArgumentParser(description='Run queued payroll jobs')
+    parser.add_argument('--once', action='store_true', help='Run queued jobs and exit instead of polling')
+    parser.add_argument('--poll-interval', type=float, default=2.0, help='Seconds between queue checks')
+    parser.add_argument('--processes', type=int, default=None,
+                        help='Process pool size for parallel jobs (defaults to CPU count)')
+    parser.add_argument('--metrics-port', type=int, default=None,
+                        help='Serve Prometheus metrics (job durations) on this port')
+    args = parser.parse_args()
+
+    if args.metrics_port:
+        start_http_server(args.metrics_port)
+
+    with app.app_context():
+        db.create_all()
+        fail_interrupted_jobs()
+
+        while True:
+            job_id = claim_next_job()
+            if job_id is not None:
+                run_job(job_id, args.processes)
+                db.session.remove()
+                continue
+            if args.once:
+                break
+            time.sleep(args.poll_interval)
+
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,146 @@
+"""
+Batch payslip PDF rendering
+Renders a PDF payslip for every MonthlyPayout in a pay period in a process
+pool. Each worker compiles the payslip template once and reuses it for every
+payslip it renders. PDFs are cached on disk under a name built from the
+payout id and updated_at, so a rerun only renders payslips that changed.
+The results are collected into a zip file or a directory.
+"""
+
+import os
+import shutil
+import zipfile
+from collections import namedtuple
+from concurrent.futures import ProcessPoolExecutor, as_completed
+
+from jinja2 import Environment, FileSystemLoader, select_autoescape
+
+from models import db, User, EmployeeDetails, MonthlyPayout
+
+PAYSLIP_TEMPLATE = 'payslip_pdf.html'
+TEMPLATE_DIR = os.path.join(os.path.dirname(os.path.abspath(__file__)), 'templates')
+
+PayslipRow = namedtuple(
+    'PayslipRow',
+    'payout_id updated_at name username email bank_name bank_account pay_period_start pay_period_end '
+    'days_worked gross_earnings advance_deduction final_payout status payment_date'
+)
+
+RenderResult = namedtuple('RenderResult', 'total rendered cached output')
+
+# Set in each pool worker by _init_worker
+_template = None
+
+
+def load_payslips(pay_period_start, pay_period_end):
+    """Load everything the payslip template needs for the period in one query"""
+    rows = (
+        db.session.query(
+            MonthlyPayout.id,
+            MonthlyPayout.updated_at,
+            User.name,
+            User.username,
+            User.email,
+            EmployeeDetails.bank_name,
+            EmployeeDetails.bank_account,
+            MonthlyPayout.pay_period_start,
+            MonthlyPayout.pay_period_end,
+            MonthlyPayout.days_worked,
+            MonthlyPayout.gross_earnings,
+            MonthlyPayout.advance_deduction,
+            MonthlyPayout.final_payout,
+            MonthlyPayout.status,
+            MonthlyPayout.payment_date
+        )
+        .join(User, User.id == MonthlyPayout.user_id)
+        .outerjoin(EmployeeDetails, EmployeeDetails.user_id == User.id)
+        .filter(
+            MonthlyPayout.pay_period_start >= pay_period_start,
+            MonthlyPayout.pay_period_end <= pay_period_end
+        )
+        .order_by(MonthlyPayout.id)
+        .all()
+    )
+    return [PayslipRow(*row) for row in rows]
+
+
+def cache_path(cache_dir, payslip):
+    """Cached PDF location; a new updated_at gives a new name"""
+    stamp = payslip.updated_at.strftime('%Y%m%d%H%M%S%f') if payslip.updated_at else '0'
+    return os.path.join(cache_dir, f'payslip_{payslip.payout_id}_{stamp}.pdf')
+
+
+def archive_name(payslip):
+    return f'{payslip.username}_{payslip.pay_period_start.isoformat()}_{payslip.pay_period_end.isoformat()}.pdf'
+
+
+def _init_worker(template_dir):
+    """Pool initializer: compile the payslip template once per process"""
+    global _template
+    env = Environment(loader=FileSystemLoader(template_dir), autoescape=select_autoescape(['html']))
+    _template = env.get_template(PAYSLIP_TEMPLATE)
+
+
+def _render_payslip(args):
+    """Render one payslip to its cache path and return the payout id"""
+    from xhtml2pdf import pisa
+
+    payslip, path = args
+    html = _template.render(payslip=payslip)
+    partial = path + '.part'
+    with open(partial, 'wb') as output:
+        status = pisa.CreatePDF(html, dest=output, encoding='utf-8')
+    if status.err:
+        os.remove(partial)
+        raise RuntimeError(f'Could not render payslip for payout {payslip.payout_id}')
+    os.replace(partial, path)
+    return payslip.payout_id
+
+
+def _remove_stale(cache_dir, payslip, current):
+    prefix = f'payslip_{payslip.payout_id}_'
+    for name in os.listdir(cache_dir):
+        if name.startswith(prefix) and name.endswith('.pdf') and os.path.join(cache_dir, name) != current:
+            os.remove(os.path.join(cache_dir, name))
+
+
+def _collect(payslips, paths, output):
+    if output.endswith('.zip'):
+        with zipfile.ZipFile(output, 'w', compression=zipfile.ZIP_DEFLATED) as archive:
+            for payslip in payslips:
+                archive.write(paths[payslip.payout_id], archive_name(payslip))
+    else:
+        os.makedirs(output, exist_ok=True)
+        for payslip in payslips:
+            shutil.copyfile(paths[payslip.payout_id], os.path.join(output, archive_name(payslip)))
+
+
+def render_payslips(pay_period_start, pay_period_end, output, cache_dir, progress=None, max_workers=None):
+    """Render the period's payslips into output (a .zip path or a directory).
+
+    progress, if given, is called as progress(done, total) after each payslip.
+    """
+    os.makedirs(cache_dir, exist_ok=True)
+    payslips = load_payslips(pay_period_start, pay_period_end)
+    paths = {payslip.payout_id: cache_path(cache_dir, payslip) for payslip in payslips}
+    pending = [payslip for payslip in payslips if not os.path.exists(paths[payslip.payout_id])]
+
+    done = len(payslips) - len(pending)
+    if progress:
+        progress(done, len(payslips))
+
+    if pending:
+        with ProcessPoolExecutor(max_workers=max_workers or os.cpu_count(),
+                                 initializer=_init_worker, initargs=(TEMPLATE_DIR,)) as executor:
+            futures = [executor.submit(_render_payslip, (payslip, paths[payslip.payout_id])) for payslip in pending]
+            for future in as_completed(futures):
+                future.result()
+                done += 1
+                if progress:
+                    progress(done, len(payslips))
+
+    for payslip in pending:
+        _remove_stale(cache_dir, payslip, paths[payslip.payout_id])
+
+    _collect(payslips, paths, output)
+    return RenderResult(len(payslips), len(pending), len(payslips) - len(pending), output)
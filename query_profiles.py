@@ -0,0 +1,50 @@
+"""
+Named eager-loading profiles for list pages
+Each profile lists the loader options a page needs so its template can walk
+relationships without a lazy load per row. The statement budget makes tests
+fail when a request issues more SQL statements than SQL_STATEMENT_LIMIT.
+"""
+
+from flask import g, request
+from sqlalchemy.orm import joinedload, selectinload
+
+from models import User, Leave, MonthlyPayout, Advance
+
+# Built lazily because backref attributes only exist once the mappers are configured
+LOAD_PROFILES = {
+    # leaves.html renders leave.user.name
+    'leave_list': lambda: (joinedload(Leave.user),),
+    # payroll.html renders payroll.user.name
+    'payroll_list': lambda: (joinedload(MonthlyPayout.user),),
+    # employees.html renders employee.employee_details
+    'employee_list': lambda: (selectinload(User.employee_details),),
+    # manage_advances.html renders advance.user.name
+    'advance_list': lambda: (joinedload(Advance.user),),
+}
+
+
+def with_profile(query, name):
+    """Apply a named loading profile to a query"""
+    return query.options(*LOAD_PROFILES[name]())
+
+
+class StatementBudgetExceeded(AssertionError):
+    """Raised when a request issues more statements than SQL_STATEMENT_LIMIT"""
+
+
+def init_statement_budget(app):
+    """Fail requests that exceed SQL_STATEMENT_LIMIT; unset or None disables the check.
+
+    Statement counts come from sql_instrumentation, which must be initialised too.
+    """
+
+    @app.after_request
+    def check_statement_budget(response):
+        limit = app.config.get('SQL_STATEMENT_LIMIT')
+        stats = g.get('sql_stats')
+        count = stats.count if stats is not None else 0
+        if limit is not None and count > limit:
+            raise StatementBudgetExceeded(
+                f'{request.method} {request.path} issued {count} SQL statements, limit is {limit}'
+            )
+        return response
@@ -0,0 +1,139 @@
+"""
+Read-replica routing
+Views decorated with @read_only send their queries to the 'replica' bind
+(DATABASE_REPLICA_URL) instead of the primary, so reporting load stays off the
+database that takes attendance writes. Flushes always go to the primary. A
+replica that is unreachable or lags more than REPLICA_MAX_LAG_SECONDS is
+skipped until a later health check finds it usable again.
+
+Lag is measured on PostgreSQL streaming replicas and MS SQL Server Always On
+secondaries (which needs VIEW SERVER STATE). Other databases are only
+checked for reachability, so REPLICA_MAX_LAG_SECONDS has no effect there.
+"""
+
+import logging
+import threading
+import time
+from functools import wraps
+
+from flask import current_app, g, has_request_context
+from flask_sqlalchemy import SQLAlchemy, SignallingSession, get_state
+from sqlalchemy import orm, text
+
+logger = logging.getLogger(__name__)
+
+REPLICA_BIND = 'replica'
+
+# Seconds the replica is behind the primary; 0 when fully replayed
+LAG_QUERIES = {
+    'postgresql': (
+        'SELECT CASE WHEN pg_last_wal_receive_lsn() = pg_last_wal_replay_lsn() THEN 0 '
+        'ELSE COALESCE(EXTRACT(EPOCH FROM now() - pg_last_xact_replay_timestamp()), 0) END'
+    ),
+    # Estimated seconds to replay the redo queue on this secondary (KB / KB per second)
+    'mssql': (
+        'SELECT COALESCE(MAX(redo_queue_size * 1.0 / NULLIF(redo_rate, 0)), 0) '
+        'FROM sys.dm_hadr_database_replica_states WHERE is_local = 1 AND database_id = DB_ID()'
+    ),
+}
+
+
+class ReplicaMonitor:
+    """Per-process cache of the replica's health, refreshed at most every interval seconds"""
+
+    def __init__(self):
+        self._lock = threading.Lock()
+        self._checked_at = None
+        self._checking = False
+        self.healthy = False
+        self.lag = None
+        self.error = None
+
+    def is_usable(self, engine, max_lag, interval):
+        with self._lock:
+            now = time.monotonic()
+            due = self._checked_at is None or now - self._checked_at >= interval
+            if not due or self._checking:
+                return self.healthy
+            self._checking = True
+
+        # Check outside the lock: a hung replica must only delay the thread
+        # refreshing it, while other requests use the last known health
+        try:
+            self._check(engine, max_lag)
+        finally:
+            with self._lock:
+                self._checked_at = time.monotonic()
+                self._checking = False
+        return self.healthy
+
+    def _check(self, engine, max_lag):
+        was_healthy = self.healthy
+        try:
+            with engine.connect() as connection:
+                query = LAG_QUERIES.get(engine.dialect.name, 'SELECT 0')
+                self.lag = float(connection.execute(text(query)).scalar() or 0)
+            self.error = None if self.lag <= max_lag else f'lag {self.lag:.1f}s exceeds {max_lag}s'
+        except Exception as e:
+            self.lag = None
+            self.error = str(e)
+        self.healthy = self.error is None
+        if was_healthy and not self.healthy:
+            logger.warning('Read replica disabled, using the primary: %s', self.error)
+        elif self.healthy and not was_healthy:
+            logger.info('Read replica available')
+
+    def status(self):
+        return {'healthy': self.healthy, 'lag_seconds': self.lag, 'error': self.error}
+
+    def reset(self):
+        with self._lock:
+            self._checked_at = None
+
+
+monitor = ReplicaMonitor()
+
+
+def replica_configured(app):
+    return REPLICA_BIND in (app.config.get('SQLALCHEMY_BINDS') or {})
+
+
+def replica_engine(app):
+    """The replica engine if configured and healthy, else None"""
+    if not replica_configured(app):
+        return None
+    engine = get_state(app).db.get_engine(app, bind=REPLICA_BIND)
+    usable = monitor.is_usable(
+        engine,
+        app.config.get('REPLICA_MAX_LAG_SECONDS', 10),
+        app.config.get('REPLICA_CHECK_INTERVAL', 5)
+    )
+    return engine if usable else None
+
+
+class RoutingSession(SignallingSession):
+    """Session that reads from the replica inside @read_only views"""
+
+    def get_bind(self, mapper=None, clause=None):
+        if not self._flushing and has_request_context() and g.get('use_replica'):
+            engine = replica_engine(self.app)
+            if engine is not None:
+                return engine
+        return super().get_bind(mapper, clause)
+
+
+class RoutingSQLAlchemy(SQLAlchemy):
+    """Flask-SQLAlchemy extension whose sessions use RoutingSession"""
+
+    def create_session(self, options):
+        return orm.sessionmaker(class_=RoutingSession, db=self, **options)
+
+
+def read_only(view):
+    """Mark a view as read-only so its queries may be served by the replica"""
+    @wraps(view)
+    def decorated_function(*args, **kwargs):
+        if replica_configured(current_app):
+            g.use_replica = True
+        return view(*args, **kwargs)
+    return decorated_function
@@ -0,0 +1,54 @@
+"""
+Short-lived cross-request cache of user roles
+Lets the auth decorators skip the user lookup on most requests. Entries
+expire after ROLE_CACHE_TTL seconds and are dropped whenever a User is
+updated or deleted through CRUDMixin. The cache is per process, so the
+TTL also bounds how long other gunicorn workers can serve a stale role.
+"""
+
+import threading
+import time
+
+
+class RoleCache:
+    """Thread-safe {user_id: role} map with a fixed time-to-live"""
+
+    def __init__(self, ttl=0):
+        self.ttl = ttl
+        self._entries = {}
+        self._lock = threading.Lock()
+
+    @property
+    def enabled(self):
+        return self.ttl > 0
+
+    def get(self, user_id):
+        """Return the cached role, or None when missing, expired or disabled"""
+        if not self.enabled:
+            return None
+        with self._lock:
+            entry = self._entries.get(user_id)
+            if entry is None:
+                return None
+            role, expires_at = entry
+            if expires_at < time.monotonic():
+                del self._entries[user_id]
+                return None
+            return role
+
+    def set(self, user_id, role):
+        if not self.enabled:
+            return
+        with self._lock:
+            self._entries[user_id] = (role, time.monotonic() + self.ttl)
+
+    def invalidate(self, user_id=None):
+        """Drop one user's entry, or everything when user_id is None"""
+        with self._lock:
+            if user_id is None:
+                self._entries.clear()
+            else:
+                self._entries.pop(user_id, None)
+
+
+role_cache = RoleCache()
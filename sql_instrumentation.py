@@ -0,0 +1,164 @@
+"""
+Per-request SQL instrumentation
+Hooks cursor execution on the app's engine to record query count, total DB
+time and the slowest statement for every request. Statements repeated inside
+one request are flagged as likely N+1 patterns. Totals are aggregated per
+endpoint for the admin SQL stats endpoint and, in debug mode, exposed as
+response headers.
+"""
+
+import logging
+import threading
+import time
+from collections import Counter
+
+from flask import g, has_request_context, request
+from sqlalchemy import event
+
+from models import db
+
+logger = logging.getLogger(__name__)
+
+# Keep the per-endpoint sample statements readable in the JSON output
+STATEMENT_PREVIEW_LENGTH = 300
+
+
+class RequestSQLStats:
+    """SQL activity recorded during one request"""
+
+    def __init__(self):
+        self.count = 0
+        self.total_time = 0.0
+        self.slowest_time = 0.0
+        self.slowest_statement = None
+        self.statements = Counter()
+
+    def record(self, statement, duration):
+        self.count += 1
+        self.total_time += duration
+        self.statements[statement] += 1
+        if duration > self.slowest_time:
+            self.slowest_time = duration
+            self.slowest_statement = statement
+
+    def repeated_statements(self, threshold):
+        """Statements executed at least threshold times, most frequent first"""
+        return [(statement, count) for statement, count in self.statements.most_common() if count >= threshold]
+
+
+class EndpointSQLStats:
+    """Process-wide SQL totals per endpoint"""
+
+    def __init__(self):
+        self._lock = threading.Lock()
+        self._endpoints = {}
+
+    def add(self, endpoint, stats, repeated):
+        with self._lock:
+            entry = self._endpoints.setdefault(endpoint, {
+                'requests': 0,
+                'queries': 0,
+                'db_time_ms': 0.0,
+                'max_queries': 0,
+                'slowest_ms': 0.0,
+                'slowest_statement': None,
+                'n_plus_one_requests': 0,
+                'n_plus_one_statements': {}
+            })
+            entry['requests'] += 1
+            entry['queries'] += stats.count
+            entry['db_time_ms'] += stats.total_time * 1000
+            entry['max_queries'] = max(entry['max_queries'], stats.count)
+            if stats.slowest_time * 1000 > entry['slowest_ms']:
+                entry['slowest_ms'] = stats.slowest_time * 1000
+                entry['slowest_statement'] = stats.slowest_statement[:STATEMENT_PREVIEW_LENGTH]
+            if repeated:
+                entry['n_plus_one_requests'] += 1
+                for statement, count in repeated:
+                    preview = statement[:STATEMENT_PREVIEW_LENGTH]
+                    entry['n_plus_one_statements'][preview] = max(
+                        entry['n_plus_one_statements'].get(preview, 0), count
+                    )
+
+    def snapshot(self):
+        """Per-endpoint totals, slowest routes first"""
+        with self._lock:
+            endpoints = []
+            for endpoint, entry in self._endpoints.items():
+                endpoints.append(dict(
+                    entry,
+                    endpoint=endpoint,
+                    db_time_ms=round(entry['db_time_ms'], 2),
+                    slowest_ms=round(entry['slowest_ms'], 2),
+                    avg_queries=round(entry['queries'] / entry['requests'], 2),
+                    avg_db_time_ms=round(entry['db_time_ms'] / entry['requests'], 2),
+                    n_plus_one_statements=dict(entry['n_plus_one_statements'])
+                ))
+        return sorted(endpoints, key=lambda entry: entry['db_time_ms'], reverse=True)
+
+    def reset(self):
+        with self._lock:
+            self._endpoints.clear()
+
+
+endpoint_stats = EndpointSQLStats()
+
+
+def current_stats():
+    """Stats for the request in progress, created on first use"""
+    if 'sql_stats' not in g:
+        g.sql_stats = RequestSQLStats()
+    return g.sql_stats
+
+
+def _before_cursor_execute(conn, cursor, statement, parameters, context, executemany):
+    conn.info.setdefault('query_start_time', []).append(time.perf_counter())
+
+
+def _after_cursor_execute(conn, cursor, statement, parameters, context, executemany):
+    started = conn.info['query_start_time'].pop()
+    if has_request_context():
+        current_stats().record(statement, time.perf_counter() - started)
+
+
+def _handle_error(exception_context):
+    # after_cursor_execute never fires for a failed statement, so drop its start time
+    connection = exception_context.connection
+    if connection is not None and connection.info.get('query_start_time'):
+        connection.info['query_start_time'].pop()
+
+
+def instrument_engine(engine):
+    """Attach the timing listeners to an engine (idempotent)"""
+    if not event.contains(engine, 'before_cursor_execute', _before_cursor_execute):
+        event.listen(engine, 'before_cursor_execute', _before_cursor_execute)
+        event.listen(engine, 'after_cursor_execute', _after_cursor_execute)
+        event.listen(engine, 'handle_error', _handle_error)
+
+
+def init_app(app):
+    """Instrument the app's engine and record stats at the end of every request"""
+    app.config.setdefault('SQL_N_PLUS_ONE_THRESHOLD', 5)
+    app.config.setdefault('SQL_STATS_HEADERS', app.debug)
+    for bind in [None] + list(app.config.get('SQLALCHEMY_BINDS') or {}):
+        instrument_engine(db.get_engine(app, bind=bind))
+
+    @app.after_request
+    def record_sql_stats(response):
+        stats = g.get('sql_stats')
+        if stats is None or request.endpoint is None:
+            return response
+
+        repeated = stats.repeated_statements(app.config['SQL_N_PLUS_ONE_THRESHOLD'])
+        if repeated:
+            statement, count = repeated[0]
+            logger.warning('Possible N+1 in %s: statement ran %d times: %s',
+                           request.endpoint, count, statement[:STATEMENT_PREVIEW_LENGTH])
+        endpoint_stats.add(request.endpoint, stats, repeated)
+
+        if app.config['SQL_STATS_HEADERS']:
+            response.headers['X-DB-Query-Count'] = str(stats.count)
+            response.headers['X-DB-Time-Ms'] = f'{stats.total_time * 1000:.2f}'
+            response.headers['X-DB-Slowest-Ms'] = f'{stats.slowest_time * 1000:.2f}'
+            response.headers['X-DB-N-Plus-One'] = str(len(repeated))
+        return response
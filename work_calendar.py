@@ -0,0 +1,151 @@
+"""
+Working-day calendar
+Holidays and weekly days off are stored per department (a NULL department
+is the company-wide calendar). Each month is turned into a bitmask with
+bit day-1 set on working days, and masks are kept in an LRU cache. Counting
+the working days in any range then takes one popcount per month touched.
+
+A department with its own weekly-off rules uses them instead of the company
+ones. Its holidays are added to the company holidays. With no rules at all,
+every day is a working day, which matches the old calendar-day proration.
+
+Rules are loaded with one query per table and cached per process for
+WORK_CALENDAR_TTL seconds. Writes through the Holiday and WeeklyOffRule
+models invalidate this process's copy straight away.
+"""
+
+import calendar
+import threading
+import time
+from collections import namedtuple
+from datetime import date, timedelta
+from functools import lru_cache
+
+from sqlalchemy import event
+
+from models import Holiday, WeeklyOffRule
+
+# (year, month, weekly_off, holidays) combinations kept; a year of 50 departments fits easily
+MASK_CACHE_SIZE = 4096
+
+DepartmentRules = namedtuple('DepartmentRules', 'weekly_off holidays')
+
+
+@lru_cache(maxsize=MASK_CACHE_SIZE)
+def month_mask(year, month, weekly_off, holidays):
+    """Working-day bitmask of a month: bit day-1 is set when that day is worked.
+
+    weekly_off is a frozenset of weekdays (0 = Monday) and holidays a frozenset
+    of day numbers in the month.
+    """
+    first_weekday, days_in_month = calendar.monthrange(year, month)
+    mask = 0
+    for day in range(1, days_in_month + 1):
+        if (first_weekday + day - 1) % 7 not in weekly_off and day not in holidays:
+            mask |= 1 << (day - 1)
+    return mask
+
+
+def _months(start, end):
+    """[(year, month), ...] touched by start..end"""
+    return [
+        (index // 12, index % 12 + 1)
+        for index in range(start.year * 12 + start.month - 1, end.year * 12 + end.month)
+    ]
+
+
+def clip_mask(mask, year, month, start, end):
+    """Keep only the bits for days between start and end inclusive"""
+    low = start.day - 1 if (start.year, start.month) == (year, month) else 0
+    high = end.day if (end.year, end.month) == (year, month) else 31
+    return mask & ((1 << high) - 1) & ~((1 << low) - 1)
+
+
+class WorkCalendar:
+    """Per-process view of the calendar rules with cached month masks"""
+
+    def __init__(self, ttl=300):
+        self.ttl = ttl
+        self._lock = threading.Lock()
+        self._rules = None
+        self._loaded_at = None
+
+    def invalidate(self):
+        with self._lock:
+            self._rules = None
+
+    def _load(self):
+        weekly_off = {}
+        for department_id, weekday in WeeklyOffRule.query.with_entities(
+                WeeklyOffRule.department_id, WeeklyOffRule.weekday):
+            weekly_off.setdefault(department_id, set()).add(weekday)
+
+        holidays = {}
+        for department_id, day in Holiday.query.with_entities(Holiday.department_id, Holiday.date):
+            holidays.setdefault(department_id, {}).setdefault((day.year, day.month), set()).add(day.day)
+
+        return {
+            'weekly_off': {key: frozenset(days) for key, days in weekly_off.items()},
+            'holidays': holidays
+        }
+
+    def _current_rules(self):
+        with self._lock:
+            expired = self._loaded_at is None or time.monotonic() - self._loaded_at >= self.ttl
+            if self._rules is None or expired:
+                self._rules = self._load()
+                self._loaded_at = time.monotonic()
+            return self._rules
+
+    def rules(self, department_id=None):
+        """DepartmentRules for a department, falling back to the company calendar"""
+        rules = self._current_rules()
+        weekly_off = rules['weekly_off'].get(department_id, rules['weekly_off'].get(None, frozenset()))
+        holidays = {}
+        for key in {None, department_id}:
+            for month, days in rules['holidays'].get(key, {}).items():
+                holidays.setdefault(month, set()).update(days)
+        return DepartmentRules(weekly_off, {month: frozenset(days) for month, days in holidays.items()})
+
+    def month_masks(self, start, end, department_id=None):
+        """[(year, month, mask clipped to start..end), ...] for every month in the range"""
+        if end < start:
+            return []
+        rules = self.rules(department_id)
+        return [
+            (year, month, clip_mask(
+                month_mask(year, month, rules.weekly_off, rules.holidays.get((year, month), frozenset())),
+                year, month, start, end
+            ))
+            for year, month in _months(start, end)
+        ]
+
+    def working_days(self, start, end, department_id=None):
+        """Number of working days between start and end inclusive"""
+        return sum(mask.bit_count() for _, _, mask in self.month_masks(start, end, department_id))
+
+    def day_bitmap(self, start, end, department_id=None):
+        """Bitmask over the range: bit i is set when start + i days is a working day"""
+        bitmap = 0
+        for year, month, mask in self.month_masks(start, end, department_id):
+            offset = (date(year, month, 1) - start).days
+            bitmap |= mask << offset if offset >= 0 else mask >> -offset
+        return bitmap
+
+    def working_dates(self, start, end, department_id=None):
+        """List the working dates between start and end inclusive"""
+        bitmap = self.day_bitmap(start, end, department_id)
+        return [start + timedelta(days=i) for i in range((end - start).days + 1) if bitmap >> i & 1]
+
+
+work_calendar = WorkCalendar()
+
+
+@event.listens_for(Holiday, 'after_insert')
+@event.listens_for(Holiday, 'after_update')
+@event.listens_for(Holiday, 'after_delete')
+@event.listens_for(WeeklyOffRule, 'after_insert')
+@event.listens_for(WeeklyOffRule, 'after_update')
+@event.listens_for(WeeklyOffRule, 'after_delete')
+def _rules_changed(mapper, connection, target):
+    work_calendar.invalidate()